@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+重复图片检测基准测试脚本
+生成可复现的合成图库（基础图像 + 缩放、重新压缩、裁剪、偏色的变体），
+分阶段计时各比较算法，并根据已知的真实分组计算精确率和召回率，结果保存为JSON便于前后对比
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import multiprocessing
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance
+
+from image_duplicate_finder import (CACHE_DIR, DuplicateScanEngine, FeatureStore, IdenticalFileIndex,
+                                    compute_feature, iter_image_files, iter_in_thread, reduce_for_feature)
+
+
+VARIANT_KINDS = ["resized", "recompressed", "cropped", "color"]  # 每张基础图像生成的变体
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+BASE_SIZE = (480, 360)  # 基础图像的宽高
+GROUPS_PER_DIR = 1000  # 每个子目录存放的图像组数，避免单个目录过大
+
+
+def make_base_image(rng, size=BASE_SIZE):
+    """低分辨率随机色块平滑放大后叠加随机几何图形，得到互不相似但有结构的基础图像"""
+    grid = rng.integers(0, 256, (rng.integers(3, 7), rng.integers(4, 9), 3), dtype=np.uint8)
+    img = Image.fromarray(grid).resize(size, Image.BICUBIC)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.integers(3, 9)):
+        x0, y0 = rng.integers(0, size[0]), rng.integers(0, size[1])
+        x1, y1 = x0 + rng.integers(20, size[0] // 2), y0 + rng.integers(20, size[1] // 2)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+    return img
+
+
+def make_variant(img, kind, rng):
+    """返回(变体图像, JPEG质量)"""
+    width, height = img.size
+    if kind == "resized":
+        scale = rng.uniform(0.4, 0.8)
+        return img.resize((int(width * scale), int(height * scale)), Image.LANCZOS), 90
+    if kind == "recompressed":
+        return img, int(rng.integers(30, 61))
+    if kind == "cropped":
+        dx, dy = int(width * rng.uniform(0.03, 0.08)), int(height * rng.uniform(0.03, 0.08))
+        return img.crop((dx, dy, width - dx, height - dy)), 90
+    # color：饱和度和亮度偏移
+    img = ImageEnhance.Color(img).enhance(rng.uniform(1.2, 1.6))
+    return ImageEnhance.Brightness(img).enhance(rng.uniform(0.85, 1.15)), 90
+
+
+def group_file_name(root, group_id, kind):
+    return os.path.join(root, f"g{group_id // GROUPS_PER_DIR:03d}", f"{group_id:06d}_{kind}.jpg")
+
+
+def generate_group(root, group_id, seed):
+    """生成一组图像：基础图像及其全部变体；每组使用独立的随机数种子，结果与生成顺序无关"""
+    rng = np.random.default_rng([seed, group_id])
+    base = make_base_image(rng)
+    os.makedirs(os.path.dirname(group_file_name(root, group_id, "base")), exist_ok=True)
+    base.save(group_file_name(root, group_id, "base"), quality=95)
+    for kind in VARIANT_KINDS:
+        variant, quality = make_variant(base, kind, rng)
+        variant.save(group_file_name(root, group_id, kind), quality=quality)
+
+
+def generate_groups(root, group_ids, seed):
+    for group_id in group_ids:
+        generate_group(root, group_id, seed)
+    return len(group_ids)
+
+
+def generate_corpus(root, image_count, seed=0, workers=None):
+    """生成合成图库；目录中已有相同参数生成的图库时直接复用，返回清单"""
+    group_count = max(1, image_count // (1 + len(VARIANT_KINDS)))
+    manifest = {"seed": seed, "groups": group_count, "variants": VARIANT_KINDS, "base_size": list(BASE_SIZE),
+                "images": group_count * (1 + len(VARIANT_KINDS))}
+    manifest_path = os.path.join(root, "corpus.json")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            if json.load(f) == manifest:
+                print(f"复用已有的图库: {root}", file=sys.stderr)
+                return manifest
+    except (OSError, ValueError):
+        pass
+
+    print(f"正在生成 {manifest['images']} 张图像到 {root} ...", file=sys.stderr)
+    os.makedirs(root, exist_ok=True)
+    batches = [range(start, min(start + 100, group_count)) for start in range(0, group_count, 100)]
+    done_count = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context) as executor:
+        for count in executor.map(generate_groups, [root] * len(batches), batches, [seed] * len(batches)):
+            done_count += count
+            print(f"生成中... {done_count}/{group_count} 组", file=sys.stderr, flush=True)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def truth_of(path):
+    """由文件名得到(真实分组, 变体类型)"""
+    group_id, kind = os.path.splitext(os.path.basename(path))[0].split("_")
+    return int(group_id), kind
+
+
+def pair_count(n):
+    return n * (n - 1) // 2
+
+
+def evaluate_groups(groups, paths):
+    """按图像对计算精确率和召回率，并统计每种变体与其基础图像被分到同一组的比例"""
+    predicted_pairs = correct_pairs = 0
+    matched = Counter()
+    for group in groups:
+        predicted_pairs += pair_count(len(group))
+        members = defaultdict(set)
+        for path in group:
+            group_id, kind = truth_of(path)
+            members[group_id].add(kind)
+        for kinds in members.values():
+            correct_pairs += pair_count(len(kinds))
+            if "base" in kinds:
+                matched.update(kind for kind in kinds if kind != "base")
+
+    truth_sizes = Counter(truth_of(path)[0] for path in paths)
+    truth_pairs = sum(pair_count(size) for size in truth_sizes.values())
+    group_count = len(truth_sizes)
+    precision = correct_pairs / predicted_pairs if predicted_pairs else 1.0
+    recall = correct_pairs / truth_pairs if truth_pairs else 1.0
+    return {
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        "recall_by_variant": {kind: round(matched[kind] / group_count, 4) for kind in VARIANT_KINDS},
+    }
+
+
+def time_decode_and_feature(paths, method, fast_decode, sample_size):
+    """在当前进程中对均匀抽样的文件分别计时解码和特征计算，返回每张图像的平均毫秒数"""
+    if not paths or sample_size <= 0:
+        return None, None
+    sample = paths[::max(1, len(paths) // sample_size)][:sample_size]
+    decode_time = feature_time = 0.0
+    for path in sample:
+        start = time.perf_counter()
+        with Image.open(path) as img:
+            img = reduce_for_feature(img, method) if fast_decode else img
+            img.load()
+        decoded = time.perf_counter()
+        compute_feature(img, method)
+        feature_time += time.perf_counter() - decoded
+        decode_time += decoded - start
+    return round(decode_time / len(sample) * 1000, 3), round(feature_time / len(sample) * 1000, 3)
+
+
+def benchmark_method(root, method, args):
+    """依次执行遍历与特征提取、比较、分组，分别计时"""
+    engine = DuplicateScanEngine(method=method, similarity_threshold=args.threshold, worker_count=args.workers,
+                                 fast_decode=not args.exact_decode)
+    engine.use_feature_cache = args.use_cache
+    engine.use_checkpoints = False
+    if args.ssim_exhaustive:
+        engine.ssim_prefilter_margin = None
+    elif args.ssim_prefilter is not None:
+        engine.ssim_prefilter_margin = args.ssim_prefilter
+    engine.folders = [os.path.abspath(root)]
+    engine.features = FeatureStore(method)
+    timings = {}
+
+    # 与DuplicateScanEngine.run相同的步骤，但分别计时
+    start = time.perf_counter()
+    identical = IdenticalFileIndex()
+    _, image_count = engine.load_feature_stream(iter_in_thread(iter_image_files(engine.folders)), identical)
+    engine.identical_groups = identical.identical_groups()
+    timings["extract"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    getattr(engine, f"find_similar_images_{method}")()
+    timings["compare"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    groups = list(engine.iter_groups())
+    timings["group"] = time.perf_counter() - start
+
+    paths = [engine.features.paths[i] for i in range(len(engine.features))]
+    decode_ms, feature_ms = time_decode_and_feature(paths, method, not args.exact_decode, args.decode_sample)
+    engine.features.close()
+
+    result = {
+        "method": method,
+        "threshold": args.threshold,
+        "ssim_prefilter": engine.ssim_prefilter_margin if method == "ssim" else None,
+        "images": image_count,
+        "groups": len(groups),
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+        "images_per_second": round(image_count / timings["extract"], 1) if timings["extract"] else None,
+        "decode_ms_per_image": decode_ms,
+        "feature_ms_per_image": feature_ms,
+    }
+    result.update(evaluate_groups(groups, [path for path, _ in iter_image_files([root])]))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在合成图库上测试各重复检测算法的速度和准确率')
+    parser.add_argument('--scale', '-s', choices=list(SCALES), default='1k', help='图库规模（默认1k）')
+    parser.add_argument('--methods', '-m', nargs='+', choices=['phash', 'histogram', 'ssim'],
+                        default=['phash', 'histogram', 'ssim'], help='要测试的算法（默认全部）')
+    parser.add_argument('--threshold', '-t', type=int, default=90, help='相似度阈值（默认90）')
+    parser.add_argument('--workers', '-w', type=int, help='特征提取的并行进程数（默认CPU核数）')
+    parser.add_argument('--seed', type=int, default=0, help='生成图库的随机数种子（默认0）')
+    parser.add_argument('--corpus-dir', help='图库目录，默认在缓存目录下按规模和种子区分')
+    parser.add_argument('--decode-sample', type=int, default=200, help='单独计时解码和特征计算的抽样文件数（默认200）')
+    parser.add_argument('--exact-decode', action='store_true', help='按原图精确解码，不使用JPEG缩放解码')
+    ssim_group = parser.add_mutually_exclusive_group()
+    ssim_group.add_argument('--ssim-prefilter', type=float, metavar='MARGIN',
+                            help='SSIM缩略图预筛选的余量（默认使用扫描引擎的默认值）')
+    ssim_group.add_argument('--ssim-exhaustive', action='store_true',
+                            help='SSIM不做预筛选，精确比较所有图像对，可与默认结果对比预筛选的召回')
+    parser.add_argument('--use-cache', action='store_true', help='读写磁盘特征缓存（默认不使用，每次都重新解码）')
+    parser.add_argument('--output', '-o', help='结果JSON文件路径，默认 benchmark_<时间>.json')
+
+    args = parser.parse_args()
+
+    root = args.corpus_dir or os.path.join(CACHE_DIR, "benchmark", f"{args.scale}_seed{args.seed}")
+    manifest = generate_corpus(root, SCALES[args.scale], args.seed, args.workers)
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "workers": args.workers or os.cpu_count(),
+        "fast_decode": not args.exact_decode,
+        "corpus": dict(manifest, scale=args.scale, path=root),
+        "results": [],
+    }
+
+    for method in args.methods:
+        print(f"正在测试 {method} ...", file=sys.stderr, flush=True)
+        result = benchmark_method(root, method, args)
+        report["results"].append(result)
+        timings = result["timings"]
+        print(f"{method:<10} 提取 {timings['extract']:.2f}s  比较 {timings['compare']:.2f}s  "
+              f"分组 {timings['group']:.2f}s  精确率 {result['precision']:.3f}  召回率 {result['recall']:.3f}")
+
+    output = args.output or time.strftime("benchmark_%Y%m%d_%H%M%S.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存至: {output}")
+
+
+if __name__ == "__main__":
+    main()
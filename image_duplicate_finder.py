@@ -1,15 +1,2652 @@
 import os
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
+import sys
+import csv
+import json
+import argparse
+from PIL import Image
 import imagehash
 import cv2
 import numpy as np
 from skimage.metrics import structural_similarity as ssim
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import multiprocessing
+import queue
+import sqlite3
 import threading
 import time
-from functools import partial
+import ctypes
+import ctypes.util
+import errno
+import select
+import shutil
+import signal
+import struct
+import tempfile
+from array import array
+from functools import lru_cache, partial
+from progress_channel import ProgressChannel
+
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+    from PIL import ImageTk
+except ImportError:  # 无图形环境的服务器上只能使用命令行模式
+    tk = None
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，不支持reflink
+    fcntl = None
+
+
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff'}
+PHASH_BITS = 64  # 8x8感知哈希的位数
+# 快速解码时各特征需要保留的最短边（目标尺寸的4倍，保证后续LANCZOS缩放质量）
+DRAFT_MIN_EDGE = {"phash": 32 * 4, "histogram": 64 * 4, "ssim": 64 * 4}
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK")  # 可以用Image.reduce整数倍缩小的模式
+IDENTICAL_PARTIAL_SIZE = 64 * 1024  # 查找相同文件时先比较的首尾字节数
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".image_duplicate_finder")
+FEATURE_CACHE_PATH = os.path.join(CACHE_DIR, "features.sqlite")
+THUMBNAIL_CACHE_DIR = os.path.join(CACHE_DIR, "thumbnails")
+THUMBNAIL_SIZE = (200, 200)  # 查看器中缩略图的最大宽高
+GRID_COLUMNS = 3  # 查看器每行显示的图像数
+GRID_CELL_SIZE = (220, 300)  # 查看器中每个单元格占用的宽高（含间距）
+GRID_SCROLL_TAG = "DuplicateGrid"  # 图像网格画布及其单元格共用的绑定标签，鼠标滚轮只在网格内滚动
+
+# inotify事件掩码（见linux/inotify.h）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+FICLONE = 0x40049409  # 整个文件的写时复制克隆ioctl（见linux/fs.h），Btrfs/XFS等文件系统支持
+# 批量处理时每组保留哪一个文件
+KEEP_RULES = {"resolution": "分辨率最高", "oldest": "修改时间最早", "shortest": "路径最短"}
+# 其余文件的处理方式；硬链接和reflink只替换与保留文件字节完全相同的文件
+RECLAIM_ACTIONS = {"delete": "删除", "hardlink": "替换为硬链接", "reflink": "替换为reflink"}
+RECLAIM_JOURNAL_DIR = os.path.join(CACHE_DIR, "journal")
+
+
+def hamming_distance(hash1, hash2):
+    """计算两个整数哈希之间的汉明距离"""
+    return bin(hash1 ^ hash2).count("1")
+
+
+def phash_max_distance(similarity_threshold, max_diff=PHASH_BITS):
+    """返回满足相似度阈值的最大汉明距离（与百分比相似度公式逐值一致）"""
+    max_distance = -1
+    for distance in range(max_diff + 1):
+        if 100 - (distance / max_diff * 100) >= similarity_threshold:
+            max_distance = distance
+    return max_distance
+
+
+# 0-255每个字节中1的个数，用于不支持np.bitwise_count的旧版NumPy
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values):
+    """逐元素统计uint64数组中1的个数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    counts = _POPCOUNT_TABLE[values.view(np.uint8)]
+    return counts.reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+class PackedHashStore:
+    """将所有感知哈希打包成连续的uint64数组，按块进行异或+popcount比较"""
+
+    def __init__(self, hashes, block_size=65536):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def subset(self, indices):
+        return PackedHashStore(self.hashes[indices], self.block_size)
+
+    def distances(self, value, start=0):
+        """计算value与start之后所有哈希的汉明距离"""
+        value = np.uint64(value)
+        result = np.empty(max(0, len(self.hashes) - start), dtype=np.uint8)
+        for block_start in range(start, len(self.hashes), self.block_size):
+            block = self.hashes[block_start:block_start + self.block_size]
+            offset = block_start - start
+            result[offset:offset + len(block)] = popcount64(np.bitwise_xor(block, value))
+        return result
+
+    def query(self, value, max_distance, start=0):
+        """返回start之后距离不超过max_distance的所有(下标数组, 距离数组)"""
+        value = np.uint64(value)
+        matches, distances = [], []
+        for block_start in range(start, len(self.hashes), self.block_size):
+            block = self.hashes[block_start:block_start + self.block_size]
+            block_distances = popcount64(np.bitwise_xor(block, value))
+            block_matches = np.flatnonzero(block_distances <= max_distance)
+            if len(block_matches):
+                matches.append(block_matches + block_start)
+                distances.append(block_distances[block_matches])
+        if not matches:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint8)
+        return np.concatenate(matches), np.concatenate(distances)
+
+    def unique_groups(self):
+        """按首次出现顺序返回哈希完全相同的下标组"""
+        if not len(self.hashes):
+            return []
+        _, first_index, inverse = np.unique(self.hashes, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.cumsum(np.bincount(inverse))[:-1]
+        groups = np.split(order, bounds)
+        return [groups[u].tolist() for u in np.argsort(first_index, kind="stable")]
+
+
+@lru_cache(maxsize=None)
+def chunk_masks(radius, bits=16):
+    """所有1的个数不超过radius的bits位取值，与某段哈希异或即得到该段距离radius以内的全部取值"""
+    values = np.arange(1 << bits, dtype=np.uint64)
+    return values[popcount64(values) <= radius].astype(np.int64)
+
+
+class MultiIndexHashStore:
+    """多索引哈希：把64位感知哈希切成4段16位，每段按取值建立倒排表（按取值排序的下标和哈希，以及每个取值的起点）
+    
+    鸽巢原理：设r = 4q + a (0 <= a < 4)，汉明距离不超过r的两个哈希，要么前a+1段中有一段距离不超过q，
+    要么其余段中有一段距离不超过q-1。因此每段只需探测这个半径内的取值，再对候选精确计算距离，
+    结果与暴力比较完全一致，而需要验证的候选只占全部图像对的很小一部分
+    """
+
+    CHUNK_BITS = 16
+    CHUNKS = PHASH_BITS // CHUNK_BITS
+
+    def __init__(self, hashes, block_elements=1 << 22):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.block_elements = block_elements  # 每次展开的候选数上限，限制内存占用
+        self.chunks, self.ranks, self.orders, self.sorted_hashes, self.bucket_starts = [], [], [], [], []
+        for chunk in range(self.CHUNKS):
+            values = self.chunk_values(self.hashes, chunk)
+            order = np.argsort(values, kind="stable")  # 同一取值内按下标递增
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            self.chunks.append(values)
+            self.ranks.append(ranks)
+            self.orders.append(order)
+            self.sorted_hashes.append(self.hashes[order])
+            self.bucket_starts.append(np.searchsorted(values[order], np.arange((1 << self.CHUNK_BITS) + 1)))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @classmethod
+    def chunk_values(cls, hashes, chunk):
+        shift = np.uint64(chunk * cls.CHUNK_BITS)
+        return ((hashes >> shift) & np.uint64((1 << cls.CHUNK_BITS) - 1)).astype(np.int64)
+
+    def chunk_radii(self, max_distance):
+        """每段需要探测的半径，负数表示该段不必探测"""
+        quotient, remainder = divmod(max_distance, self.CHUNKS)
+        return [quotient if chunk <= remainder else quotient - 1 for chunk in range(self.CHUNKS)]
+
+    def query_range(self, start, end, max_distance):
+        """返回由下标[start, end)的哈希负责的、距离不超过max_distance的全部图像对(行, 列, 距离)，行 < 列
+        
+        每对只由一个哈希负责：只在第一个满足半径的段中记录；该段取值相同时由下标较小者负责，
+        取值不同时由取值在两者差异最高位上为0的一方负责。按区间依次查询全部下标即得到每对恰好一次
+        """
+        radii = self.chunk_radii(max_distance)
+        rows, cols, distances = [], [], []
+        for chunk, radius in enumerate(radii):
+            if radius < 0:
+                continue
+            masks = chunk_masks(radius, self.CHUNK_BITS)
+            step = max(1, self.block_elements // len(masks))
+            for block_start in range(start, end, step):
+                queries = np.arange(block_start, min(block_start + step, end))
+                self._query_chunk(chunk, masks, queries, max_distance, radii, rows, cols, distances)
+        
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        rows, cols, distances = np.concatenate(rows), np.concatenate(cols), np.concatenate(distances)
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order], distances[order]
+
+    def _query_chunk(self, chunk, masks, queries, max_distance, radii, rows, cols, distances):
+        """在一段的倒排表中探测queries负责的候选并精确验证，结果追加到rows/cols/distances"""
+        values = self.chunks[chunk][queries]
+        probes = values[:, None] ^ masks[None, :]
+        bucket_starts = self.bucket_starts[chunk]
+        lows = bucket_starts[probes]
+        counts = bucket_starts[probes + 1] - lows
+        # 取值相同：只与同一取值中下标更大的哈希比较；取值不同：只在差异最高位为0时比较
+        same = masks == 0
+        lows[:, same] = self.ranks[chunk][queries, None] + 1
+        counts[:, same] = bucket_starts[values + 1, None] - lows[:, same]
+        top_bits = masks.copy()
+        for shift in (1, 2, 4, 8):
+            top_bits |= top_bits >> shift
+        top_bits -= top_bits >> 1  # 每个mask的最高位
+        counts[(values[:, None] & top_bits[None, :]) != 0] = 0
+        
+        # 按候选数把查询再分成小块，逐块把倒排表区间展开为候选位置（按查询依次排列）
+        query_counts = counts.sum(axis=1)
+        cumulative = np.cumsum(query_counts)
+        first = 0
+        while first < len(queries):
+            budget = (cumulative[first - 1] if first else 0) + self.block_elements
+            last = max(first + 1, int(np.searchsorted(cumulative, budget, side="right")))
+            block_counts = counts[first:last].ravel()
+            total = int(block_counts.sum())
+            if total:
+                offsets = np.cumsum(block_counts) - block_counts
+                positions = np.repeat(lows[first:last].ravel() - offsets, block_counts) + np.arange(total)
+                query_hashes = np.repeat(self.hashes[queries[first:last]], query_counts[first:last])
+                differences = np.bitwise_xor(self.sorted_hashes[chunk][positions], query_hashes)
+                candidate_distances = popcount64(differences)
+                hits = np.flatnonzero(candidate_distances <= max_distance)
+                
+                # 已在前面的段中满足半径的图像对由该段记录
+                differences = differences[hits]
+                keep = np.ones(len(hits), dtype=bool)
+                for earlier in range(chunk):
+                    if radii[earlier] >= 0:
+                        keep &= popcount64(self.chunk_values(differences, earlier).astype(np.uint64)) > radii[earlier]
+                hits = hits[keep]
+                
+                hit_rows = np.repeat(queries[first:last], query_counts[first:last])[hits]
+                hit_cols = self.orders[chunk][positions[hits]]
+                rows.append(np.minimum(hit_rows, hit_cols))
+                cols.append(np.maximum(hit_rows, hit_cols))
+                distances.append(candidate_distances[hits])
+            first = last
+
+
+def calculate_histogram(img):
+    """计算彩色图像的直方图特征"""
+    # 将图像转换为BGR格式（OpenCV使用BGR）
+    img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+    
+    # 转换为HSV空间
+    hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
+    
+    # 计算HSV直方图
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 8, 8], [0, 180, 0, 256, 0, 256])
+    
+    # 归一化直方图
+    cv2.normalize(hist, hist, 0, 1.0, cv2.NORM_MINMAX)
+    
+    return hist.flatten()
+
+
+def prepare_for_ssim(img):
+    """准备图像用于SSIM比较，统一大小并转为灰度"""
+    # 调整图像大小为标准尺寸(64x64)
+    img_resized = img.resize((64, 64), Image.LANCZOS)
+    
+    # 转换为灰度图
+    if img_resized.mode != 'L':
+        img_gray = img_resized.convert('L')
+    else:
+        img_gray = img_resized
+        
+    # 转换为numpy数组
+    return np.array(img_gray)
+
+
+def compare_histograms(hist1, hist2):
+    """比较两个直方图，返回相似度百分比"""
+    # 使用相关性方法比较直方图
+    # 相关性方法返回范围为[-1, 1]的值，1表示完全匹配
+    correlation = cv2.compareHist(hist1.reshape(-1, 1), hist2.reshape(-1, 1), cv2.HISTCMP_CORREL)
+    
+    # 将相关性转换为百分比相似度(范围0-100)
+    similarity = max(0, (correlation + 1) / 2 * 100)
+    
+    return similarity
+
+
+def compare_ssim(img1, img2):
+    """使用SSIM比较两个图像，返回相似度百分比"""
+    # 计算SSIM，范围为[-1, 1]
+    ssim_score = ssim(img1, img2)
+    
+    # 转换为百分比相似度(范围0-100)
+    similarity = max(0, (ssim_score + 1) / 2 * 100)
+    
+    return similarity
+
+
+def file_digest(path, size=None, partial_size=None):
+    """计算文件的BLAKE2摘要；指定partial_size时只读取首尾各partial_size字节"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        if partial_size is None:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        else:
+            digest.update(f.read(partial_size))
+            if size > partial_size:
+                f.seek(max(partial_size, size - partial_size))
+                digest.update(f.read(partial_size))
+    return digest.digest()
+
+
+class IdenticalFileIndex:
+    """流式查找字节完全相同的文件，不解码图像
+    
+    文件按出现顺序逐个加入：大小与之前的文件都不同时不读取内容；大小相同时比较首尾部分摘要，
+    部分摘要也相同且文件较长时再比较完整摘要。每组第一个出现的文件作为代表。
+    指定digest_cache（如FeatureCache）时摘要按(路径, 大小, 修改时间)读写缓存，重新扫描时未变化的文件不再读取
+    """
+
+    def __init__(self, partial_size=IDENTICAL_PARTIAL_SIZE, digest_cache=None):
+        self.partial_size = partial_size
+        self.digest_cache = digest_cache
+        self.first_of_size = {}  # 文件大小 -> 该大小第一个文件的(路径, 序号, 修改时间)，出现第二个同样大小的文件后改为None
+        self.by_partial = defaultdict(list)  # (文件大小, 部分摘要) -> 代表文件
+        self.stats = {}  # 已读取部分摘要的文件 -> (大小, 修改时间)，计算完整摘要时查找缓存
+        self.full_digests = {}
+        self.positions = {}  # 代表文件 -> 加入时的序号，用于按出现顺序排列分组
+        self.groups = {}  # 代表文件 -> [代表文件, 副本...]
+        self.count = 0
+
+    def add(self, path, size, mtime_ns=None):
+        """加入一个文件；它是之前某个文件的副本时返回该代表文件，否则返回None"""
+        position = self.count
+        self.count += 1
+        if size <= 0:
+            return None
+        if size not in self.first_of_size:
+            self.first_of_size[size] = (path, position, mtime_ns)
+            return None
+        if self.first_of_size[size] is not None:
+            self._index(*self.first_of_size[size], size)
+            self.first_of_size[size] = None
+        
+        try:
+            self.stats[path] = (size, mtime_ns)
+            key = (size, self._digest(path, False))
+            for representative in self.by_partial.get(key, ()):
+                # 不超过首尾两段长度的文件已被完整读取，无需再算完整摘要
+                if size <= 2 * self.partial_size or self._full_digest(representative) == self._full_digest(path):
+                    self.groups.setdefault(representative, [representative]).append(path)
+                    return representative
+        except OSError as e:
+            print(f"无法读取文件 {path}: {e}", file=sys.stderr)
+            return None
+        self.by_partial[key].append(path)
+        self.positions[path] = position
+        return None
+
+    def _index(self, path, position, mtime_ns, size):
+        try:
+            self.stats[path] = (size, mtime_ns)
+            self.by_partial[(size, self._digest(path, False))].append(path)
+            self.positions[path] = position
+        except OSError as e:
+            print(f"无法读取文件 {path}: {e}", file=sys.stderr)
+
+    def _full_digest(self, path):
+        if path not in self.full_digests:
+            self.full_digests[path] = self._digest(path, True)
+        return self.full_digests[path]
+
+    def _digest(self, path, full):
+        """完整摘要或首尾部分摘要；有缓存且文件未变化时直接使用缓存的值"""
+        size, mtime_ns = self.stats[path]
+        cache = self.digest_cache if mtime_ns is not None else None
+        kind = "full" if full else f"partial{self.partial_size}"
+        if cache is not None:
+            digest = cache.get_digest(path, kind, size, mtime_ns)
+            if digest is not None:
+                return digest
+        digest = file_digest(path) if full else file_digest(path, size, self.partial_size)
+        if cache is not None:
+            cache.put_digest(path, kind, size, mtime_ns, digest)
+        return digest
+
+    def identical_groups(self):
+        """按代表文件出现顺序返回所有文件组"""
+        return sorted(self.groups.values(), key=lambda group: self.positions[group[0]])
+
+
+def find_identical_files(paths, partial_size=IDENTICAL_PARTIAL_SIZE, check_cancelled=None):
+    """按 文件大小 -> 首尾部分哈希 -> 完整摘要 逐级筛选字节完全相同的文件
+    
+    返回按首次出现顺序排列的文件组，每组第一个文件作为代表；check_cancelled在每个文件前调用
+    """
+    index = IdenticalFileIndex(partial_size)
+    for path in paths:
+        if check_cancelled is not None:
+            check_cancelled()
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"无法读取文件 {path}: {e}", file=sys.stderr)
+            continue
+        index.add(path, size)
+    return index.identical_groups()
+
+
+def iter_image_files(folders):
+    """用os.scandir逐个目录遍历，按与os.walk相同的顺序产出(路径, stat)
+    
+    stat取自目录项，Windows上无需额外的系统调用；无法获取stat的文件产出(路径, None)
+    """
+    for folder in folders:
+        stack = [folder]
+        while stack:
+            directory = stack.pop()
+            subdirectories = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            # 与os.walk默认行为一致，不进入指向目录的符号链接
+                            if not entry.is_symlink():
+                                subdirectories.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS:
+                            try:
+                                yield entry.path, entry.stat()
+                            except OSError:
+                                yield entry.path, None
+            except OSError:
+                continue
+            stack.extend(reversed(subdirectories))
+
+
+def iter_in_thread(iterable, maxsize=1024):
+    """在后台线程中迭代iterable，经有界队列逐个产出
+    
+    消费端停止迭代时后台线程随之退出；后台线程中的异常在消费端重新抛出
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+    errors = []
+    
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        put(end)
+    
+    thread = threading.Thread(target=produce, name="walker", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                if errors:
+                    raise errors[0]
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def read_ahead(path):
+    """让操作系统提前把文件读入页缓存，工作进程随后解码时无需等待磁盘或网络"""
+    try:
+        with open(path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while f.read(1 << 20):
+                    pass
+    except OSError:
+        pass
+
+
+def iter_merged_groups(groups, identical_groups):
+    """把字节相同的副本并入其代表文件所在的组逐组产出，代表文件未被分组的副本组最后单独产出"""
+    copies_of = {group[0]: group[1:] for group in identical_groups}
+    grouped = set()
+    for group in groups:
+        expanded = []
+        for path in group:
+            expanded.append(path)
+            expanded.extend(copies_of.get(path, ()))
+            grouped.add(path)
+        yield expanded
+    
+    for group in identical_groups:
+        if group[0] not in grouped:
+            yield list(group)
+
+
+def reduce_for_feature(img, method):
+    """利用JPEG缩放解码(draft)和整数倍预缩小，快速得到足以计算特征的小图"""
+    min_edge = DRAFT_MIN_EDGE[method]
+    
+    # JPEG可在DCT阶段按1/2、1/4、1/8缩放解码，解码耗时和内存随之下降
+    if img.format == "JPEG":
+        if method != "histogram":
+            # 感知哈希和SSIM只需要灰度，直接只解码亮度通道
+            img.draft("L", (min_edge, min_edge))
+        elif img.mode == "RGB":
+            img.draft("RGB", (min_edge, min_edge))
+    
+    # 其他格式（或缩放后仍然很大）先用廉价的整数倍缩小，再交给LANCZOS；
+    # reduce不支持的模式（如16位的I;16）或缩小出错时保留原图，按精确解码处理
+    factor = min(img.size) // min_edge
+    if factor >= 2 and img.mode in REDUCIBLE_MODES:
+        try:
+            img = img.reduce(factor)
+        except (ValueError, OSError):
+            pass
+    return img
+
+
+def feature_cache_key(method, fast_decode):
+    """缓存中区分精确解码与快速解码得到的特征"""
+    return f"{method}:draft" if fast_decode else method
+
+
+def compute_feature(img, method, fast_decode=False):
+    """根据所选方法计算特征"""
+    if fast_decode:
+        img = reduce_for_feature(img, method)
+    
+    if method == "phash":
+        # 使用感知哈希
+        return imagehash.phash(img)
+    elif method == "histogram":
+        # 使用颜色直方图
+        return calculate_histogram(img)
+    # 为SSIM准备图像数据
+    return prepare_for_ssim(img)
+
+
+def extract_feature_chunk(paths, method, fast_decode=False):
+    """在工作进程中解码一批图像，只返回序列化后的紧凑特征(特征字节, 错误信息)"""
+    results = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                feature = compute_feature(img, method, fast_decode)
+                results.append((encode_feature(method, feature), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def normalize_for_correlation(vectors):
+    """均值中心化并做L2归一化，使两行的点积等于皮尔逊相关系数(HISTCMP_CORREL)"""
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    matrix = matrix - matrix.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(matrix, axis=1)
+    # 与cv2.compareHist一致：任一直方图方差为0时相关性记为1
+    constant = norms <= np.finfo(np.float32).eps
+    matrix /= np.where(constant, 1, norms)[:, None]
+    return matrix, constant
+
+
+def histogram_similarity_blocks(vectors, similarity_threshold, block_size=2048, start_row=0):
+    """分块矩阵乘法批量计算直方图相似度
+    
+    每次处理一个行块，与其后所有列块相乘（每个块不超过block_size x block_size个float32），
+    按行块依次产出(行块起点, 行块终点, 行下标, 列下标, 相似度)，只包含i < j且相似度不低于阈值的图像对；
+    从检查点继续时由start_row指定第一个行块的起点
+    """
+    matrix, constant = normalize_for_correlation(vectors)
+    total = len(matrix)
+    
+    for row_start in range(start_row, total, block_size):
+        row_end = min(row_start + block_size, total)
+        row_block = matrix[row_start:row_end]
+        rows, cols, similarities = [], [], []
+        
+        for col_start in range(row_start, total, block_size):
+            col_end = min(col_start + block_size, total)
+            correlation = row_block @ matrix[col_start:col_end].T
+            correlation[constant[row_start:row_end], :] = 1
+            correlation[:, constant[col_start:col_end]] = 1
+            
+            # 与compare_histograms相同的百分比换算
+            similarity = np.maximum(0, (correlation + 1) / 2 * 100)
+            tile_rows, tile_cols = np.nonzero(similarity >= similarity_threshold)
+            tile_rows += row_start
+            tile_cols += col_start
+            upper = tile_cols > tile_rows
+            rows.append(tile_rows[upper])
+            cols.append(tile_cols[upper])
+            similarities.append(similarity[tile_rows[upper] - row_start, tile_cols[upper] - col_start])
+        
+        yield row_start, row_end, np.concatenate(rows), np.concatenate(cols), np.concatenate(similarities)
+
+
+def connected_components(total, rows, cols):
+    """向量化并查集：反复把每条边两端的根挂到较小的根上并压缩路径，返回每个节点的根（即所在分量的最小下标）"""
+    parent = np.arange(total)
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    while len(rows):
+        root_rows, root_cols = parent[rows], parent[cols]
+        unsettled = root_rows != root_cols
+        if not unsettled.any():
+            break
+        # 两端已同根的边以后也不会分开，直接丢弃
+        rows, cols = rows[unsettled], cols[unsettled]
+        root_rows, root_cols = root_rows[unsettled], root_cols[unsettled]
+        np.minimum.at(parent, np.maximum(root_rows, root_cols), np.minimum(root_rows, root_cols))
+        
+        # 路径压缩
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+
+class SimilarityGraph:
+    """保存相似度不低于下限的稀疏边表(i, j, 相似度)，调整阈值时只需重新计算连通分量
+    
+    监视模式下删除节点只做标记，边在下次重建邻接索引时才真正清除；邻接索引(CSR)按需建立，
+    之后追加的边先放在未索引的尾部，尾部超过已索引边数的1/4时再整体重建，
+    因此增量分组的开销只与变化的节点及其邻边有关，与图库大小无关
+    """
+
+    def __init__(self, paths, rows, cols, similarities, floor):
+        self.paths = paths  # 与FeatureStore共用的路径表，新节点由特征库追加
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.similarities = np.asarray(similarities, dtype=np.float32)
+        self.floor = floor
+        self.removed = np.zeros(0, dtype=bool)  # 已删除的节点
+        self._adjacency = None  # 前_indexed条边的(indptr, 相邻节点, 相似度)
+        self._indexed = 0
+
+    def _removed_mask(self):
+        """与路径表等长的删除标记，新节点未删除"""
+        if len(self.removed) < len(self.paths):
+            removed = np.zeros(max(len(self.paths), 2 * len(self.removed)), dtype=bool)
+            removed[:len(self.removed)] = self.removed
+            self.removed = removed
+        return self.removed
+
+    def _live_edges(self):
+        """两端节点都未删除的边"""
+        removed = self._removed_mask()
+        return ~(removed[self.rows] | removed[self.cols])
+
+    def iter_groups(self, similarity_threshold):
+        """逐组产出阈值下的重复组，组按首个成员的扫描顺序排列，与比较顺序无关"""
+        keep = (self.similarities >= similarity_threshold) & self._live_edges()
+        labels = connected_components(len(self.paths), self.rows[keep], self.cols[keep])
+        
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        starts = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+        for members in np.split(order, starts):
+            if len(members) > 1:
+                yield [self.paths[i] for i in members]
+
+    def groups(self, similarity_threshold):
+        return list(self.iter_groups(similarity_threshold))
+
+    def add_edges(self, rows, cols, similarities):
+        self.rows = np.concatenate((self.rows, np.asarray(rows, dtype=np.int64)))
+        self.cols = np.concatenate((self.cols, np.asarray(cols, dtype=np.int64)))
+        self.similarities = np.concatenate((self.similarities, np.asarray(similarities, dtype=np.float32)))
+
+    def remove_nodes(self, indices):
+        """删除节点及其所有边；下标不复用，对应路径置为None，成为不会被分组的孤立点"""
+        indices = np.asarray(indices, dtype=np.int64)
+        self._removed_mask()[indices] = True
+        for index in indices.tolist():
+            self.paths[index] = None
+
+    def _build_adjacency(self):
+        """清除已删除节点的边，并为全部边建立双向的CSR邻接索引"""
+        live = self._live_edges()
+        self.rows, self.cols, self.similarities = self.rows[live], self.cols[live], self.similarities[live]
+        sources = np.concatenate((self.rows, self.cols))
+        order = np.argsort(sources, kind="stable")
+        indptr = np.searchsorted(sources[order], np.arange(len(self.paths) + 1))
+        adjacent = np.concatenate((self.cols, self.rows))[order]
+        self._adjacency = (indptr, adjacent, np.concatenate((self.similarities, self.similarities))[order])
+        self._indexed = len(self.rows)
+
+    def _neighbours(self, nodes, similarity_threshold):
+        """nodes沿阈值以上的边可以到达的相邻节点（可能重复，含已删除的节点）"""
+        indptr, adjacent, similarities = self._adjacency
+        indexed = nodes[nodes < len(indptr) - 1]
+        starts = indptr[indexed]
+        lengths = indptr[indexed + 1] - starts
+        # 把各节点在CSR中的区间拼成一个下标数组
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + \
+            np.repeat(starts, lengths)
+        found = [adjacent[positions][similarities[positions] >= similarity_threshold]]
+        
+        # 建立索引后追加的边较少，直接扫描
+        rows, cols = self.rows[self._indexed:], self.cols[self._indexed:]
+        if len(rows):
+            tail = self.similarities[self._indexed:] >= similarity_threshold
+            rows, cols = rows[tail], cols[tail]
+            found.append(cols[np.isin(rows, nodes)])
+            found.append(rows[np.isin(cols, nodes)])
+        return np.concatenate(found)
+
+    def component_groups(self, seeds, similarity_threshold):
+        """只求包含seeds中节点的重复组：从种子出发沿阈值以上的边逐层扩展"""
+        if self._adjacency is None or len(self.rows) - self._indexed > max(1024, self._indexed // 4):
+            self._build_adjacency()
+        removed = self._removed_mask()
+        label = {}  # 已访问的节点 -> 所在组的种子
+        groups = []
+        for seed in seeds:
+            if seed in label or removed[seed]:
+                continue
+            label[seed] = seed
+            members = frontier = np.array([seed], dtype=np.int64)
+            while len(frontier):
+                neighbours = np.unique(self._neighbours(frontier, similarity_threshold))
+                frontier = np.array([node for node in neighbours.tolist() if node not in label and not removed[node]],
+                                    dtype=np.int64)
+                label.update((node, seed) for node in frontier.tolist())
+                members = np.concatenate((members, frontier))
+            if len(members) > 1:
+                groups.append([self.paths[i] for i in np.sort(members)])
+        return groups
+
+
+class HistogramIVFIndex:
+    """颜色直方图的近似最近邻索引：k-means粗量化 + 倒排列表(IVF)
+    
+    n_lists越多、每次探测的列表n_probe越少，速度越快但召回率越低；
+    top_k限制每张图片最多保留的候选数，只有候选才会精确计算相似度
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, n_iter=10, seed=0, block_size=8192):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.block_size = block_size
+        self.centroids = None
+        self.list_members = None  # 按列表排序后的图像下标
+        self.list_offsets = None
+        self.fingerprint = None
+
+    @staticmethod
+    def compute_fingerprint(matrix):
+        return hashlib.blake2b(np.ascontiguousarray(matrix).data, digest_size=16).hexdigest()
+
+    def _scores(self, matrix):
+        for start in range(0, len(matrix), self.block_size):
+            yield start, matrix[start:start + self.block_size] @ self.centroids.T
+
+    def _nearest_lists(self, matrix, count):
+        """返回每行最相近的count个列表编号"""
+        nearest = np.empty((len(matrix), count), dtype=np.int64)
+        for start, scores in self._scores(matrix):
+            if count < scores.shape[1]:
+                top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            nearest[start:start + len(scores)] = top
+        return nearest
+
+    def build(self, matrix):
+        """在归一化后的直方图矩阵上训练球面k-means并建立倒排列表"""
+        total = len(matrix)
+        n_lists = min(total, self.n_lists or max(1, int(4 * np.sqrt(total))))
+        rng = np.random.default_rng(self.seed)
+        
+        # 只在采样子集上训练聚类中心
+        sample = matrix[rng.choice(total, min(total, n_lists * 64), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignments = self._nearest_lists(sample, 1)[:, 0]
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=n_lists)
+            non_empty = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+            
+            centroids = sample[rng.choice(len(sample), n_lists)].copy()  # 空列表重新随机取中心
+            centroids[non_empty] = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            self.centroids = centroids / np.where(norms > 0, norms, 1)
+        
+        assignments = self._nearest_lists(matrix, 1)[:, 0]
+        self.list_members = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
+        self.fingerprint = self.compute_fingerprint(matrix)
+        return self
+
+    def similar_pairs(self, matrix, constant, similarity_threshold, top_k=32):
+        """探测最近的n_probe个列表，精确计算候选相似度，返回每张图片top_k内且不低于阈值的(i, j, 相似度)，i < j"""
+        n_lists = len(self.centroids)
+        probes = self._nearest_lists(matrix, min(self.n_probe, n_lists))
+        query_ids = np.repeat(np.arange(len(matrix)), probes.shape[1])
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind="stable")
+        query_ids, probe_lists = query_ids[order], probe_lists[order]
+        query_bounds = np.searchsorted(probe_lists, np.arange(n_lists + 1))
+        
+        rows, cols, similarities = [], [], []
+        for list_id in range(n_lists):
+            queries = query_ids[query_bounds[list_id]:query_bounds[list_id + 1]]
+            members = self.list_members[self.list_offsets[list_id]:self.list_offsets[list_id + 1]]
+            if not len(queries) or not len(members):
+                continue
+            
+            correlation = matrix[queries] @ matrix[members].T
+            correlation[constant[queries], :] = 1
+            correlation[:, constant[members]] = 1
+            similarity = np.maximum(0, (correlation + 1) / 2 * 100)
+            
+            query_index, member_index = np.nonzero(similarity >= similarity_threshold)
+            keep = queries[query_index] != members[member_index]
+            rows.append(queries[query_index[keep]])
+            cols.append(members[member_index[keep]])
+            similarities.append(similarity[query_index[keep], member_index[keep]])
+        
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float32)
+        rows, cols, similarities = np.concatenate(rows), np.concatenate(cols), np.concatenate(similarities)
+        
+        # 每张图片只保留top_k个最相似的候选
+        order = np.lexsort((-similarities, rows))
+        rows, cols, similarities = rows[order], cols[order], similarities[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        keep = rank < top_k
+        rows, cols, similarities = rows[keep], cols[keep], similarities[keep]
+        
+        # 统一为i < j并去掉双向重复
+        lower, upper = np.minimum(rows, cols), np.maximum(rows, cols)
+        _, unique_index = np.unique(lower * len(matrix) + upper, return_index=True)
+        return lower[unique_index], upper[unique_index], similarities[unique_index]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, centroids=self.centroids, list_members=self.list_members,
+                 list_offsets=self.list_offsets, fingerprint=np.array(self.fingerprint))
+
+    def load_or_build(self, matrix, path):
+        """特征未变化且参数相同时直接读取保存的索引，否则重新训练并保存"""
+        fingerprint = self.compute_fingerprint(matrix)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    same_lists = self.n_lists is None or len(data["centroids"]) == min(len(matrix), self.n_lists)
+                    if str(data["fingerprint"]) == fingerprint and same_lists:
+                        self.centroids = data["centroids"]
+                        self.list_members = data["list_members"]
+                        self.list_offsets = data["list_offsets"]
+                        self.fingerprint = fingerprint
+                        return self
+            except Exception as e:
+                print(f"无法读取直方图索引 {path}: {e}", file=sys.stderr)
+        
+        self.build(matrix)
+        try:
+            self.save(path)
+        except OSError as e:
+            print(f"无法保存直方图索引 {path}: {e}", file=sys.stderr)
+        return self
+
+
+SSIM_WIN_SIZE = 7  # 与skimage默认参数一致：7x7均匀窗口、样本协方差、data_range=255
+SSIM_COV_NORM = SSIM_WIN_SIZE ** 2 / (SSIM_WIN_SIZE ** 2 - 1)
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+# 缩略图SSIM预筛选的默认余量：合成图库(1000张)上保存下限不低于80%时没有漏掉任何精确SSIM达到下限的图像对，
+# 候选对不到全部的1%；阈值很低时召回会下降，需要完整结果时可关闭预筛选
+SSIM_PREFILTER_MARGIN = 0.3
+
+
+@lru_cache(maxsize=None)
+def ssim_box_matrix(size):
+    """(size-6, size)的0/1矩阵，第k行对应第k个窗口覆盖的7个像素"""
+    w = SSIM_WIN_SIZE
+    matrix = np.zeros((size - w + 1, size), dtype=np.float32)
+    for k in range(size - w + 1):
+        matrix[k, k:k + w] = 1
+    return matrix
+
+
+def ssim_window_means(images):
+    """用两次矩阵乘法B·X·Bᵀ计算每个完整7x7窗口的均值，等价于uniform_filter后裁掉边缘
+    
+    输入为8位像素或两幅8位图像的乘积时窗口和小于2^24，float32下求和是精确的
+    """
+    images = np.asarray(images, dtype=np.float32)
+    height, width = images.shape[1:]
+    sums = ssim_box_matrix(height) @ images @ ssim_box_matrix(width).T
+    return sums * np.float32(1 / SSIM_WIN_SIZE ** 2)
+
+
+def ssim_image_stats(images):
+    """预先计算每张图像各窗口的均值和方差，配对时只需再计算协方差"""
+    images = np.asarray(images, dtype=np.float32)
+    means = ssim_window_means(images)
+    variances = SSIM_COV_NORM * (ssim_window_means(images * images) - means * means)
+    return means, variances.astype(np.float32)
+
+
+def batched_ssim(images1, images2, stats1, stats2):
+    """对堆叠的成对图像批量计算SSIM，结果与skimage的structural_similarity一致（误差在1e-5以内）
+    
+    每对图像只需计算乘积的窗口均值，其余都是原地的float32逐元素运算
+    """
+    (ux, vx), (uy, vy) = stats1, stats2
+    # 2*协方差 + C2
+    numerator = ssim_window_means(np.asarray(images1, dtype=np.float32) * images2)
+    product = ux * uy
+    numerator -= product
+    numerator *= 2 * SSIM_COV_NORM
+    numerator += SSIM_C2
+    # (2*ux*uy + C1) * (2*协方差 + C2)
+    product *= 2
+    product += SSIM_C1
+    numerator *= product
+    # (ux² + uy² + C1) * (vx + vy + C2)
+    denominator = ux * ux
+    denominator += uy * uy
+    denominator += SSIM_C1
+    variance_sum = vx + vy
+    variance_sum += SSIM_C2
+    denominator *= variance_sum
+    numerator /= denominator
+    return numerator.mean(axis=(1, 2), dtype=np.float64)
+
+
+def ssim_thumbnail_stats(images):
+    """8x8块均值缩略图的(均值, 中心化像素, 方差)，用于单窗口SSIM预筛选"""
+    images = np.asarray(images, dtype=np.float32)
+    total = len(images)
+    height, width = images.shape[1:]
+    thumbs = images.reshape(total, 8, height // 8, 8, width // 8).mean(axis=(2, 4)).reshape(total, -1)
+    means = thumbs.mean(axis=1)
+    centered = thumbs - means[:, None]
+    variances = (centered * centered).mean(axis=1)
+    return means, centered, variances
+
+
+def thumbnail_ssim_scores(stats1, stats2):
+    """两组缩略图两两之间的单窗口SSIM，返回(len1, len2)矩阵"""
+    (mu1, centered1, var1), (mu2, centered2, var2) = stats1, stats2
+    mu1, var1, mu2, var2 = mu1[:, None], var1[:, None], mu2[None, :], var2[None, :]
+    covariance = centered1 @ centered2.T / centered1.shape[1]
+    return ((2 * mu1 * mu2 + SSIM_C1) * (2 * covariance + SSIM_C2)) / \
+           ((mu1 * mu1 + mu2 * mu2 + SSIM_C1) * (var1 + var2 + SSIM_C2))
+
+
+def ssim_candidate_pairs(images, min_score, block_size=2048):
+    """预筛选SSIM候选对：在8x8块均值缩略图上计算单窗口SSIM，返回得分不低于min_score的(i, j)，i < j
+    
+    这只是近似：缩略图SSIM并不是完整SSIM的上界，低对比度但相似的图像对可能被漏掉
+    """
+    means, centered, variances = ssim_thumbnail_stats(images)
+    total = len(means)
+    
+    rows, cols = [], []
+    for row_start in range(0, total, block_size):
+        row_end = min(row_start + block_size, total)
+        row_stats = (means[row_start:row_end], centered[row_start:row_end], variances[row_start:row_end])
+        for col_start in range(row_start, total, block_size):
+            col_end = min(col_start + block_size, total)
+            col_stats = (means[col_start:col_end], centered[col_start:col_end], variances[col_start:col_end])
+            score = thumbnail_ssim_scores(row_stats, col_stats)
+            
+            tile_rows, tile_cols = np.nonzero(score >= min_score)
+            tile_rows += row_start
+            tile_cols += col_start
+            upper = tile_cols > tile_rows
+            rows.append(tile_rows[upper])
+            cols.append(tile_cols[upper])
+    
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def upper_triangle_pairs(total, start, end):
+    """按行优先顺序编号的上三角图像对(i, j)，i < j，返回编号在[start, end)内的部分，不必生成全部图像对"""
+    index = np.arange(start, end, dtype=np.int64)
+    row_starts = np.arange(total, dtype=np.int64)
+    row_starts = row_starts * total - row_starts * (row_starts + 1) // 2  # 第i行第一个图像对的编号
+    rows = np.searchsorted(row_starts, index, side="right") - 1
+    return rows, index - row_starts[rows] + rows + 1
+
+
+def verify_ssim_pairs(images, rows, cols, floor, batch_size=128, progress_callback=None, stats=None):
+    """批量精确计算候选对的SSIM，返回相似度不低于floor的(行下标, 列下标, 相似度)
+    
+    stats为全部图像预先计算的(窗口均值, 窗口方差)；为None时只为出现在候选对中的图像计算
+    """
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    
+    if stats is None:
+        involved = np.unique(np.concatenate((rows, cols)))
+        stats_index = np.full(len(images), -1, dtype=np.int64)
+        stats_index[involved] = np.arange(len(involved))
+        means, variances = ssim_image_stats(images[involved])
+    else:
+        stats_index = np.arange(len(images), dtype=np.int64)
+        means, variances = stats
+    
+    total_comparisons = len(rows)
+    matched_rows, matched_cols, matched_similarities = [], [], []
+    
+    for start in range(0, total_comparisons, batch_size):
+        batch_rows, batch_cols = rows[start:start + batch_size], cols[start:start + batch_size]
+        index1, index2 = stats_index[batch_rows], stats_index[batch_cols]
+        scores = batched_ssim(images[batch_rows], images[batch_cols],
+                              (means[index1], variances[index1]), (means[index2], variances[index2]))
+        
+        # 与compare_ssim相同的百分比换算
+        similarity = np.maximum(0, (scores + 1) / 2 * 100)
+        matched = similarity >= floor
+        matched_rows.append(batch_rows[matched])
+        matched_cols.append(batch_cols[matched])
+        matched_similarities.append(similarity[matched])
+        
+        # 每批更新一次进度，避免UI过度更新
+        if progress_callback is not None:
+            progress_callback(min(start + batch_size, total_comparisons), total_comparisons)
+    
+    if not matched_rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(matched_rows), np.concatenate(matched_cols), np.concatenate(matched_similarities)
+
+
+def encode_feature(method, feature):
+    """将特征序列化为紧凑的字节串，便于写入缓存"""
+    if method == "phash":
+        return np.packbits(feature.hash.reshape(-1)).tobytes()
+    elif method == "histogram":
+        return np.asarray(feature, dtype=np.float32).tobytes()
+    return np.asarray(feature, dtype=np.uint8).tobytes()
+
+
+class PathTable:
+    """紧凑的路径表：每个目录字符串只保存一份，文件只记录目录ID和驻留的文件名；已删除的条目为None"""
+
+    def __init__(self, paths=()):
+        self.dirs = []
+        self.dir_index = {}
+        self.dir_ids = array("i")
+        self.names = []
+        self.extend(paths)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        name = self.names[index]
+        if name is None:
+            return None
+        return os.path.join(self.dirs[self.dir_ids[index]], name)
+
+    def __setitem__(self, index, path):
+        if path is None:
+            self.names[index] = None
+            return
+        dir_id, name = self._split(path)
+        self.dir_ids[index] = dir_id
+        self.names[index] = name
+
+    def _split(self, path):
+        directory, name = os.path.split(path)
+        dir_id = self.dir_index.get(directory)
+        if dir_id is None:
+            dir_id = self.dir_index[directory] = len(self.dirs)
+            self.dirs.append(sys.intern(directory))
+        return dir_id, sys.intern(name)
+
+    def append(self, path):
+        dir_id, name = self._split(path)
+        self.dir_ids.append(dir_id)
+        self.names.append(name)
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def truncate(self, size):
+        del self.dir_ids[size:]
+        del self.names[size:]
+
+
+class FeatureStore:
+    """列式特征存储：路径表 + 每种特征一个连续的NumPy数组，比较代码统一使用整数ID（行号）
+    
+    感知哈希存为uint64，颜色直方图存为float32 (n, 512)，SSIM图像存为uint8 (n, 64, 64)；
+    指定memmap_dir时数组映射到该目录下的临时文件，内存中只保留正在访问的页
+    """
+
+    # 方法 -> (每行形状, 存储类型, 缓存字节串中的类型)
+    LAYOUTS = {
+        "phash": ((), np.uint64, ">u8"),
+        "histogram": ((512,), np.float32, np.float32),
+        "ssim": ((64, 64), np.uint8, np.uint8),
+    }
+
+    def __init__(self, method, memmap_dir=None, capacity=1024):
+        self.method = method
+        self.row_shape, self.dtype, self.blob_dtype = self.LAYOUTS[method]
+        self.paths = PathTable()  # ID -> 路径
+        self.size = 0
+        self.memmap_path = None
+        if memmap_dir is not None:
+            os.makedirs(memmap_dir, exist_ok=True)
+            fd, self.memmap_path = tempfile.mkstemp(prefix=f"features_{method}_", suffix=".bin", dir=memmap_dir)
+            os.close(fd)
+        self.data = self._allocate(max(1, capacity))
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def features(self):
+        """全部特征行组成的连续数组视图"""
+        return self.data[:self.size]
+
+    def _allocate(self, capacity):
+        shape = (capacity,) + self.row_shape
+        if self.memmap_path is None:
+            data = np.empty(shape, dtype=self.dtype)
+            if self.size:
+                data[:self.size] = self.data[:self.size]
+            return data
+        
+        # 磁盘映射的数组直接扩大文件，已写入的特征不需要复制
+        with open(self.memmap_path, "r+b") as f:
+            f.truncate(int(np.prod(shape)) * np.dtype(self.dtype).itemsize)
+        return np.memmap(self.memmap_path, dtype=self.dtype, mode="r+", shape=shape)
+
+    def reserve(self, paths):
+        """为paths追加空行，返回第一个新ID"""
+        start = self.size
+        end = start + len(paths)
+        if end > len(self.data):
+            self.data = self._allocate(max(end, 2 * len(self.data)))
+        self.paths.extend(paths)
+        self.size = end
+        return start
+
+    def set_blob(self, feature_id, blob):
+        """把缓存或工作进程返回的特征字节串直接写入对应行，不创建中间对象"""
+        self.data[feature_id] = np.frombuffer(blob, dtype=self.blob_dtype).reshape(self.row_shape)
+
+    def compact(self, start, keep):
+        """丢弃start之后keep为False的行（无法解码的文件），保持其余行的顺序"""
+        keep = np.asarray(keep, dtype=bool)
+        if keep.all():
+            return
+        kept = np.flatnonzero(keep) + start
+        paths = [self.paths[i] for i in kept.tolist()]
+        end = start + len(kept)
+        self.data[start:end] = self.data[kept]
+        self.paths.truncate(start)
+        self.paths.extend(paths)
+        self.size = end
+
+    def close(self):
+        """删除磁盘映射文件"""
+        if self.memmap_path is not None:
+            self.data = None
+            try:
+                os.remove(self.memmap_path)
+            except OSError:
+                pass
+            self.memmap_path = None
+
+
+class FeatureCache:
+    """持久化的特征缓存，以(路径, 文件大小, 修改时间, 算法)判断是否需要重新计算；
+    同时缓存查找字节相同文件时计算的文件摘要"""
+
+    def __init__(self, db_path=FEATURE_CACHE_PATH, commit_interval=1000, flush_interval=10.0):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "path TEXT NOT NULL, method TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, feature BLOB NOT NULL, "
+            "PRIMARY KEY (path, method))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            "path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, digest BLOB NOT NULL, "
+            "PRIMARY KEY (path, kind))"
+        )
+        self.commit_interval = commit_interval
+        self.flush_interval = flush_interval  # 最多间隔多少秒提交一次，进程被中断时最多丢失这段时间的特征
+        self.pending_writes = 0
+        self.last_flush = time.time()
+
+    def get(self, path, method, size, mtime_ns):
+        """返回缓存的特征字节串；文件已变化或未缓存时返回None"""
+        row = self.conn.execute(
+            "SELECT feature FROM features WHERE path=? AND method=? AND size=? AND mtime_ns=?",
+            (path, method, size, mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, path, method, size, mtime_ns, blob):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO features (path, method, size, mtime_ns, feature) VALUES (?, ?, ?, ?, ?)",
+            (path, method, size, mtime_ns, blob)
+        )
+        self._written()
+
+    def get_digest(self, path, kind, size, mtime_ns):
+        """返回缓存的文件摘要（kind为"full"或部分摘要的类型）；文件已变化或未缓存时返回None"""
+        row = self.conn.execute(
+            "SELECT digest FROM digests WHERE path=? AND kind=? AND size=? AND mtime_ns=?",
+            (path, kind, size, mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_digest(self, path, kind, size, mtime_ns, digest):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO digests (path, kind, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+            (path, kind, size, mtime_ns, digest)
+        )
+        self._written()
+
+    def _written(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_interval or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.conn.commit()
+        self.pending_writes = 0
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class BKTree:
+    """基于汉明距离的BK树，用于快速查找给定距离内的哈希"""
+
+    def __init__(self, distance_func=hamming_distance):
+        self.distance_func = distance_func
+        self.root = None  # 节点结构: [哈希值, 条目, {距离: 子节点}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = self.distance_func(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def query(self, value, max_distance):
+        """返回所有距离不超过max_distance的(距离, 条目)"""
+        results = []
+        if self.root is None:
+            return results
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = self.distance_func(value, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[1]))
+
+            # 三角不等式：只有距离在[d-r, d+r]之间的子树可能包含结果
+            low = distance - max_distance
+            high = distance + max_distance
+            for child_distance, child in node[2].items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        return results
+
+
+class IncrementalMatcher:
+    """监视模式下的增量比较器
+    
+    直接使用FeatureStore中按ID排列的特征，只额外保存比较所需的派生数组（容量成倍增长）；
+    删除只清除有效标记，新文件只需与现有特征做一次向量化比较，不必重新比较整个图库
+    """
+
+    def __init__(self, store, floor, ssim_prefilter_margin=None, block_elements=1 << 22):
+        self.store = store
+        self.method = store.method
+        self.floor = floor
+        self.ssim_prefilter_margin = ssim_prefilter_margin
+        self.block_elements = block_elements  # 每次比较的(新节点 x 候选)元素数上限，限制内存占用
+        self.size = 0
+        self.columns = {}
+        self.alive = np.zeros(0, dtype=bool)
+
+    def derived_columns(self, rows):
+        """由特征行计算比较时使用的派生数组：直方图的归一化矩阵、SSIM的缩略图统计量"""
+        if self.method == "histogram":
+            matrix, constant = normalize_for_correlation(rows)
+            return {"matrix": matrix, "constant": constant}
+        elif self.method == "ssim":
+            means, centered, variances = ssim_thumbnail_stats(rows)
+            return {"thumb_mean": means, "thumb_centered": centered, "thumb_var": variances}
+        return {}
+
+    def sync(self):
+        """为特征库中新追加的行计算派生数组"""
+        end = len(self.store)
+        if end <= self.size:
+            return
+        columns = self.derived_columns(self.store.features[self.size:end])
+        if end > len(self.alive):
+            capacity = max(end, 2 * len(self.alive), 1024)
+            for name, values in columns.items():
+                grown = np.zeros((capacity,) + values.shape[1:], dtype=values.dtype)
+                if name in self.columns:
+                    grown[:self.size] = self.columns[name][:self.size]
+                self.columns[name] = grown
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self.size] = self.alive[:self.size]
+            self.alive = alive
+        
+        for name, values in columns.items():
+            self.columns[name][self.size:end] = values
+        self.alive[self.size:end] = True
+        self.size = end
+
+    def remove(self, indices):
+        self.alive[np.asarray(indices, dtype=np.int64)] = False
+
+    def similar_pairs(self, start):
+        """比较下标start之后的新节点与下标更小的全部有效节点，返回相似度不低于下限的(i, j, 相似度)"""
+        alive = self.alive[:self.size]
+        queries = np.flatnonzero(alive[start:]) + start
+        candidates = np.flatnonzero(alive)
+        columns = self.columns
+        features = self.store.features
+        max_distance = phash_max_distance(self.floor)
+        min_score = self.floor / 50 - 1 - (self.ssim_prefilter_margin or 0)
+        rows, cols, similarities = [], [], []
+        
+        step = max(1, self.block_elements // max(1, len(candidates)))
+        for block_start in range(0, len(queries), step):
+            block = queries[block_start:block_start + step]
+            if self.method == "phash":
+                distances = popcount64(np.bitwise_xor(features[block, None], features[None, candidates]))
+                matched = distances <= max_distance
+                similarity = 100 - (distances.astype(np.float32) / PHASH_BITS * 100)
+            elif self.method == "histogram":
+                correlation = columns["matrix"][block] @ columns["matrix"][candidates].T
+                correlation[columns["constant"][block], :] = 1
+                correlation[:, columns["constant"][candidates]] = 1
+                similarity = np.maximum(0, (correlation + 1) / 2 * 100)
+                matched = similarity >= self.floor
+            else:
+                # SSIM的候选对最后统一精确验证；启用预筛选时先用缩略图排除明显不相似的图像对
+                stats = [(columns["thumb_mean"][i], columns["thumb_centered"][i], columns["thumb_var"][i])
+                         for i in (block, candidates)]
+                similarity = None
+                if self.ssim_prefilter_margin is None:
+                    matched = np.ones((len(block), len(candidates)), dtype=bool)
+                else:
+                    matched = thumbnail_ssim_scores(*stats) >= min_score
+            
+            matched &= candidates[None, :] < block[:, None]
+            block_rows, block_cols = np.nonzero(matched)
+            rows.append(block[block_rows])
+            cols.append(candidates[block_cols])
+            if similarity is not None:
+                similarities.append(similarity[block_rows, block_cols])
+        
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+        if self.method == "ssim":
+            return verify_ssim_pairs(features, rows, cols, self.floor) if len(rows) else \
+                (rows, cols, np.empty(0))
+        return rows, cols, np.concatenate(similarities) if similarities else np.empty(0)
+
+
+def load_inotify():
+    """通过ctypes加载libc中的inotify接口，非Linux或不可用时返回None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FolderWatcher:
+    """监视文件夹中的图像变化，按批回调on_change(新增或修改, 删除, 移动)
+    
+    Linux上订阅inotify事件，只重新列出发生事件的目录；inotify不可用时定期完整遍历。
+    两种方式都与文件快照(大小, 修改时间, inode)比较，旧路径消失且同一inode出现在新路径上视为移动
+    """
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+
+    def __init__(self, folders, poll_interval=5.0, settle_time=1.0, max_batch_delay=10.0, use_inotify=True):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.poll_interval = poll_interval  # 轮询模式下两次遍历的间隔秒数
+        self.settle_time = settle_time  # 事件停止这么久后才处理，避免读到写了一半的文件
+        self.max_batch_delay = max_batch_delay  # 事件持续不断时最多积攒这么久就处理一批
+        self.use_inotify = use_inotify
+        self.snapshot = {}  # 路径 -> (大小, 修改时间, inode)
+        self.files_in_dir = defaultdict(set)
+        self.libc = None
+        self.inotify_fd = None
+        self.watch_dirs = {}  # inotify监视描述符 -> 目录
+        self.started = False
+
+    def start(self):
+        """订阅inotify并记录初始快照；在首次完整扫描之前调用，扫描期间的变化也不会遗漏"""
+        if self.use_inotify:
+            libc = load_inotify()
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC) if libc is not None else -1
+            if fd >= 0:
+                self.libc, self.inotify_fd = libc, fd
+        self.rescan({folder: True for folder in self.folders})
+        self.started = True
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+            self.watch_dirs = {}
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify_fd is not None else "轮询"
+
+    def add_watch(self, directory):
+        if self.inotify_fd is None:
+            return
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd >= 0:
+            # 目录被移动后再次添加会返回原来的描述符，这里同时更新它对应的路径
+            self.watch_dirs[wd] = directory
+        elif ctypes.get_errno() == errno.ENOSPC:
+            print("inotify监视数量已达上限(fs.inotify.max_user_watches)，改为定期轮询", file=sys.stderr)
+            self.close()
+
+    def list_dir(self, directory, recursive):
+        """列出目录中的图像文件及其(大小, 修改时间, inode)，recursive时包括所有子目录"""
+        entries = {}
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            if recursive:
+                self.add_watch(current)
+            try:
+                with os.scandir(current) as iterator:
+                    for entry in iterator:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if recursive:
+                                    pending.append(entry.path)
+                            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS:
+                                stat = entry.stat()
+                                entries[entry.path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                        except OSError:
+                            continue
+            except OSError:
+                continue  # 目录已被删除或移走
+        return entries
+
+    def rescan(self, scopes):
+        """重新列出scopes {目录: 是否递归} 并与快照比较，返回(新增或修改, 删除, 移动)"""
+        old, new = {}, {}
+        for directory, recursive in scopes.items():
+            if recursive:
+                prefix = directory + os.sep
+                directories = [d for d in self.files_in_dir if d == directory or d.startswith(prefix)]
+            else:
+                directories = [directory]
+            for d in directories:
+                for path in self.files_in_dir.get(d, ()):
+                    old[path] = self.snapshot[path]
+            new.update(self.list_dir(directory, recursive))
+        
+        for path in old:
+            del self.snapshot[path]
+            directory = os.path.dirname(path)
+            self.files_in_dir[directory].discard(path)
+            if not self.files_in_dir[directory]:
+                del self.files_in_dir[directory]
+        for path, signature in new.items():
+            self.snapshot[path] = signature
+            self.files_in_dir[os.path.dirname(path)].add(path)
+        return self.diff(old, new)
+
+    @staticmethod
+    def diff(old, new):
+        removed = [path for path in old if path not in new]
+        removed_by_inode = {old[path][2]: path for path in removed}
+        changed, moved, moved_from = [], [], set()
+        for path, signature in new.items():
+            if old.get(path) == signature:
+                continue
+            source = removed_by_inode.get(signature[2]) if path not in old else None
+            if source is not None and source not in moved_from and old[source][:2] == signature[:2]:
+                moved.append((source, path))
+                moved_from.add(source)
+            else:
+                changed.append(path)
+        deleted = [path for path in removed if path not in moved_from]
+        return changed, deleted, moved
+
+    def read_events(self, scopes):
+        """读取inotify事件，把需要重新列出的目录记入scopes"""
+        try:
+            data = os.read(self.inotify_fd, 1 << 16)
+        except BlockingIOError:
+            return
+        
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，可能丢失了变化，全部重新列出
+                for folder in self.folders:
+                    scopes[folder] = True
+                continue
+            directory = self.watch_dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watch_dirs[wd]
+            elif mask & IN_DELETE_SELF:
+                scopes[directory] = True
+            elif mask & IN_ISDIR:
+                # 子目录新建、删除或移入移出，递归列出其中的文件
+                scopes[os.path.join(directory, name)] = True
+            elif name:
+                scopes.setdefault(directory, False)
+
+    def run(self, on_change, stop_event=None):
+        """阻塞监视直到stop_event被设置，每批变化调用一次on_change"""
+        stop_event = stop_event or threading.Event()
+        if not self.started:
+            self.start()
+        scopes, first_event = {}, None
+        try:
+            while not stop_event.is_set():
+                if self.inotify_fd is None:
+                    if stop_event.wait(self.poll_interval):
+                        break
+                    changes = self.rescan({folder: True for folder in self.folders})
+                else:
+                    ready, _, _ = select.select([self.inotify_fd], [], [], self.settle_time)
+                    if ready:
+                        self.read_events(scopes)
+                        first_event = first_event or time.time()
+                        if time.time() - first_event < self.max_batch_delay:
+                            continue
+                    if not scopes:
+                        continue
+                    changes = self.rescan(scopes)
+                    scopes, first_event = {}, None
+                
+                if any(changes):
+                    on_change(*changes)
+        finally:
+            self.close()
+
+
+def concatenate_edges(rows, cols, similarities):
+    """把分批得到的边数组拼接成(行, 列, 相似度)"""
+    return (np.concatenate(rows) if rows else np.empty(0, dtype=np.int64),
+            np.concatenate(cols) if cols else np.empty(0, dtype=np.int64),
+            np.concatenate(similarities) if similarities else np.empty(0, dtype=np.float32))
+
+
+def ignore_interrupt():
+    """工作进程忽略Ctrl+C，由主进程统一取消并保存检查点"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ScanCancelled(Exception):
+    """扫描被取消；已提取的特征和比较进度已保存，重新扫描时从中断处继续"""
+
+
+class ComparisonCheckpoint:
+    """比较阶段的检查点
+    
+    定期把已得到的边和下一个待处理位置写入磁盘；路径、特征和比较参数完全相同的扫描
+    重新开始时从该位置继续，全部完成后删除
+    """
+
+    def __init__(self, path, fingerprint, interval=30.0):
+        self.path = path
+        self.fingerprint = fingerprint  # 输入的摘要，不一致的检查点会被忽略
+        self.interval = interval
+        self.last_save = time.time()
+
+    def load(self):
+        """返回(下一个位置, 行, 列, 相似度)；没有匹配的检查点时从0开始"""
+        try:
+            with np.load(self.path) as data:
+                if str(data["fingerprint"]) == self.fingerprint:
+                    return int(data["position"]), data["rows"], data["cols"], data["similarities"]
+        except (OSError, KeyError, ValueError):
+            pass
+        return (0,) + concatenate_edges([], [], [])
+
+    def due(self):
+        return time.time() - self.last_save >= self.interval
+
+    def save(self, position, rows, cols, similarities):
+        """先写临时文件再替换，保存过程中被中断也不会损坏上一个检查点"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, fingerprint=np.array(self.fingerprint), position=np.array(position),
+                     rows=rows, cols=cols, similarities=similarities)
+        os.replace(temp_path, self.path)
+        self.last_save = time.time()
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class DuplicateScanEngine:
+    """不依赖Tk的扫描与比较引擎，图形界面和命令行共用"""
+
+    def __init__(self, method="phash", similarity_threshold=90, worker_count=None, fast_decode=True,
+                 progress_callback=None, status_callback=None):
+        self.method = method
+        self.similarity_threshold = similarity_threshold
+        self.worker_count = worker_count or os.cpu_count() or 1  # 特征提取的并行进程数
+        self.fast_decode = fast_decode  # JPEG缩放解码，False时按原图精确解码
+        self.progress_callback = progress_callback  # progress_callback(已完成数, 总数, 阶段)
+        self.status_callback = status_callback  # status_callback(状态文字)
+        
+        # 调优参数
+        self.extract_chunk_size = 32  # 每次发送给工作进程的文件数
+        self.walk_queue_size = 4096  # 遍历线程领先特征提取的最多文件数
+        self.read_ahead_threads = 4  # 预读文件的线程数，网络存储上可适当调大
+        self.use_identical_cascade = True  # 解码前先按文件大小和摘要找出字节完全相同的文件
+        self.use_feature_cache = True  # 是否使用磁盘特征缓存，未变化的文件不再重新解码
+        self.histogram_ann_min_images = 20000  # 超过该数量时颜色直方图改用近似最近邻索引，0表示始终精确比较
+        self.histogram_ann_lists = None  # 倒排列表数，None时自动取4*sqrt(n)
+        self.histogram_ann_probe = 8  # 每张图片探测的列表数，越大召回越高
+        self.histogram_ann_top_k = 32  # 每张图片最多保留的候选数
+        # 缩略图SSIM预筛选允许低于阈值的余量。预筛选是近似的，可能漏掉低对比度的相似图像对；
+        # None表示精确比较所有图像对
+        self.ssim_prefilter_margin = SSIM_PREFILTER_MARGIN
+        self.ssim_batch_size = 128  # 每批精确计算SSIM的图像对数
+        # 感知哈希相似搜索方式: "auto"不同哈希数达到phash_index_min_images时用多索引哈希，否则暴力比较；
+        # "mih"多索引哈希、"brute"分块异或+popcount、"bktree"索引（阈值较低时接近全量比较）
+        self.phash_search = "auto"
+        self.phash_index_min_images = 100000  # 保存下限80%（距离12位）时多索引哈希在约10万张以上才快于暴力比较
+        self.edge_floor_margin = 10  # 保存比当前阈值最多低多少的边
+        self.feature_memmap_dir = None  # 指定目录时特征数组映射到磁盘文件，None表示保存在内存中
+        self.use_checkpoints = True  # 比较阶段定期保存检查点，取消或中断后重新扫描时从中断处继续
+        self.checkpoint_interval = 30  # 检查点保存间隔秒数
+        
+        # 取消与暂停：由其他线程（界面、信号处理）设置，扫描线程在每次报告进度时检查
+        self._cancel_event = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        
+        # 扫描结果
+        self.folders = []
+        self.image_count = 0
+        self.features = None  # FeatureStore：路径表和连续的特征数组，ID即相似度图的节点下标
+        self.similarity_graph = None  # 比较阶段保存的相似度边表，用于调整阈值后即时重新分组
+        self.identical_groups = []  # 字节完全相同的文件组
+        
+        # 监视模式的增量索引，首次应用文件变化时建立
+        self._matcher = None
+        self._node_index = {}  # 路径 -> 相似度图节点下标
+        self._identical_of = {}  # 路径 -> 所在的字节相同文件组
+        self._removed_nodes = []  # 本次应用变化时待删除的节点下标
+
+    def report_status(self, message):
+        if self.status_callback is not None:
+            self.status_callback(message)
+
+    def report_progress(self, done, total, stage):
+        self.check_cancelled()
+        if self.progress_callback is not None:
+            self.progress_callback(done, total, stage)
+
+    def cancel(self):
+        """请求取消扫描（可从任意线程调用）；暂停中的扫描也会立即退出"""
+        self._cancel_event.set()
+        self._running.set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def check_cancelled(self):
+        """暂停时在此等待；已请求取消时抛出ScanCancelled"""
+        self._running.wait()
+        if self._cancel_event.is_set():
+            raise ScanCancelled("扫描已取消")
+
+    def list_image_files(self, folders):
+        """获取所有文件夹中的图像文件"""
+        return [path for path, _ in iter_image_files(folders)]
+    
+    def scan(self, folders):
+        """扫描文件夹并返回所有重复组"""
+        self.run(folders)
+        return list(self.iter_groups())
+    
+    def run(self, folders):
+        """提取特征并比较，结果保存在相似度边表中，随后可用iter_groups按阈值取出分组"""
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self._cancel_event.clear()
+        if self.features is not None:
+            self.features.close()
+        self.features = FeatureStore(self.method, self.feature_memmap_dir)
+        self.similarity_graph = None
+        self.identical_groups = []
+        self._matcher = None
+        method = self.method
+        
+        # 遍历、查找字节相同的文件和特征提取流水线式重叠执行：后台线程遍历目录，
+        # 副本直接成组无需解码，其余文件边发现边交给工作进程
+        self.report_status("正在扫描文件夹...")
+        identical = IdenticalFileIndex() if self.use_identical_cascade else None
+        entries = iter_in_thread(iter_image_files(self.folders), self.walk_queue_size)
+        _, self.image_count = self.load_feature_stream(entries, identical)
+        if not self.image_count:
+            self.report_status("扫描完成：没有找到图像")
+            return
+        
+        # 查找相似图像
+        if method == "phash":
+            self.find_similar_images_phash()
+        elif method == "histogram":
+            self.find_similar_images_histogram()
+        else:  # ssim
+            self.find_similar_images_ssim()
+        
+        if identical is not None:
+            self.identical_groups = identical.identical_groups()
+    
+    def load_features(self, file_paths):
+        """读取缓存或解码得到特征，按file_paths的顺序追加到特征库，跳过无法处理的文件；返回第一个新ID"""
+        # 文件很少时（如监视模式的一次变化）直接在当前进程解码，避免启动工作进程的开销
+        workers = 1 if len(file_paths) <= self.extract_chunk_size else None
+        return self.load_feature_stream(((path, None) for path in file_paths), workers=workers)[0]
+    
+    def load_feature_stream(self, entries, identical=None, workers=None):
+        """按entries（(路径, stat或None)）的顺序追加特征，返回(第一个新ID, 文件数)
+        
+        每个文件依次经过：字节相同文件的查找（identical不为None时，副本不分配ID）、磁盘缓存、
+        预读线程和工作进程解码；提交给工作进程的文件块有上限，内存占用不随图库大小增长。
+        使用磁盘缓存时，查找字节相同文件所需的摘要先查缓存，新算出的摘要随特征一起保存
+        """
+        method = self.method
+        fast_decode = self.fast_decode
+        cache_method = feature_cache_key(method, fast_decode)
+        cache = FeatureCache() if self.use_feature_cache else None
+        if identical is not None:
+            identical.digest_cache = cache
+        store = self.features
+        start = len(store)
+        workers = max(1, workers or self.worker_count)
+        chunk_size = self.extract_chunk_size
+        loaded = bytearray()  # 每个新ID是否成功得到特征
+        counts = {"files": 0, "done": 0}
+        
+        # 使用spawn启动工作进程，避免在带有Tk线程的进程中fork；工作进程忽略Ctrl+C，由主进程统一取消
+        process_pool = None
+        if workers > 1:
+            process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=ignore_interrupt)
+        read_pool = ThreadPoolExecutor(max_workers=self.read_ahead_threads, thread_name_prefix="read-ahead")
+        in_flight = deque()  # (文件块, Future)，按提交顺序
+        chunk = []  # 待提交的(ID, 路径, 缓存键)
+        
+        def finish(chunk, results):
+            for (feature_id, path, cache_key), (blob, error) in zip(chunk, results):
+                counts["done"] += 1
+                if blob is None:
+                    print(f"无法处理文件 {path}: {error}", file=sys.stderr)
+                    continue
+                store.set_blob(feature_id, blob)
+                loaded[feature_id - start] = 1
+                if cache is not None:
+                    cache.put(*cache_key, blob)
+        
+        def submit(chunk):
+            paths = [path for _, path, _ in chunk]
+            for path in paths:
+                read_pool.submit(read_ahead, path)
+            if process_pool is None:
+                finish(chunk, extract_feature_chunk(paths, method, fast_decode))
+                return
+            in_flight.append((chunk, process_pool.submit(extract_feature_chunk, paths, method, fast_decode)))
+            # 在途的文件块达到上限或最早的已完成时取回结果；暂停时不再提交，工作进程很快空闲
+            while in_flight and (len(in_flight) >= workers * 2 or in_flight[0][1].done()):
+                done_chunk, future = in_flight.popleft()
+                finish(done_chunk, future.result())
+        
+        try:
+            for path, stat in entries:
+                counts["files"] += 1
+                self.report_progress(counts["done"], counts["files"], "扫描中")
+                try:
+                    if stat is None:
+                        stat = os.stat(path)
+                    if identical is not None and identical.add(path, stat.st_size, stat.st_mtime_ns) is not None:
+                        counts["done"] += 1  # 字节相同的副本，随代表文件一起成组
+                        continue
+                    cache_key = (os.path.abspath(path), cache_method, stat.st_size, stat.st_mtime_ns)
+                    blob = cache.get(*cache_key) if cache is not None else None
+                except Exception as e:
+                    print(f"无法处理文件 {path}: {e}", file=sys.stderr)
+                    counts["done"] += 1
+                    continue
+                
+                feature_id = store.reserve([path])
+                loaded.append(0)
+                if blob is not None:
+                    store.set_blob(feature_id, blob)
+                    loaded[-1] = 1
+                    counts["done"] += 1
+                    continue
+                
+                chunk.append((feature_id, path, cache_key))
+                if len(chunk) >= chunk_size:
+                    submit(chunk)
+                    chunk = []
+            
+            if chunk:
+                submit(chunk)
+            while in_flight:
+                self.report_progress(counts["done"], counts["files"], "扫描中")
+                done_chunk, future = in_flight.popleft()
+                finish(done_chunk, future.result())
+            self.report_progress(counts["done"], counts["files"], "扫描中")
+        finally:
+            # 提前退出时取消尚未开始的任务；关闭entries使遍历线程停止
+            if hasattr(entries, "close"):
+                entries.close()
+            read_pool.shutdown(wait=False, cancel_futures=True)
+            if process_pool is not None:
+                process_pool.shutdown(wait=True, cancel_futures=True)
+            if cache is not None:
+                cache.close()
+            if identical is not None:
+                identical.digest_cache = None
+        
+        store.compact(start, np.frombuffer(bytes(loaded), dtype=np.uint8).astype(bool))
+        return start, counts["files"]
+    
+    def similarity_floor(self, similarity_threshold):
+        """比较阶段保存边的相似度下限，阈值在[下限, 100]内调整时无需重新比较"""
+        return max(1, similarity_threshold - self.edge_floor_margin)
+    
+    def folder_key(self):
+        """由扫描的文件夹得到的短键，用于索引和检查点文件名"""
+        return hashlib.blake2b("\n".join(sorted(self.folders)).encode("utf-8"), digest_size=8).hexdigest()
+    
+    def comparison_checkpoint(self, floor):
+        """本次比较的检查点；指纹包含比较参数、全部路径和特征，任何一项变化都会使旧检查点失效"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.method}|{floor}|{self.ssim_prefilter_margin}".encode("utf-8"))
+        paths = self.features.paths
+        for i in range(len(paths)):
+            digest.update(f"\n{paths[i]}".encode("utf-8", "surrogateescape"))
+        digest.update(np.ascontiguousarray(self.features.features).data)
+        path = os.path.join(CACHE_DIR, "checkpoints", f"{self.method}_{self.folder_key()}.npz")
+        return ComparisonCheckpoint(path, digest.hexdigest(), self.checkpoint_interval)
+    
+    def resumable_edges(self, floor, total, step, stage="比较中"):
+        """分步执行比较并返回拼接后的(行, 列, 相似度)
+        
+        step(位置)处理从该位置开始的一批，返回(下一个位置, 行, 列, 相似度)；启用检查点时定期保存已得到的边，
+        取消时先保存再抛出ScanCancelled，下次扫描从保存的位置继续
+        """
+        checkpoint = self.comparison_checkpoint(floor) if self.use_checkpoints else None
+        position, rows, cols, similarities = checkpoint.load() if checkpoint is not None else \
+            (0,) + concatenate_edges([], [], [])
+        rows, cols, similarities = [rows], [cols], [similarities]
+        if position:
+            self.report_status(f"从检查点继续比较（{position}/{total}）...")
+        
+        try:
+            while position < total:
+                self.report_progress(position, total, stage)
+                position, block_rows, block_cols, block_similarities = step(position)
+                rows.append(block_rows)
+                cols.append(block_cols)
+                similarities.append(block_similarities)
+                if checkpoint is not None and checkpoint.due():
+                    checkpoint.save(position, *concatenate_edges(rows, cols, similarities))
+                    rows, cols, similarities = [[part] for part in concatenate_edges(rows, cols, similarities)]
+        except ScanCancelled:
+            if checkpoint is not None:
+                checkpoint.save(position, *concatenate_edges(rows, cols, similarities))
+            raise
+        
+        self.report_progress(total, total, stage)
+        if checkpoint is not None:
+            checkpoint.clear()
+        return concatenate_edges(rows, cols, similarities)
+    
+    def find_similar_images_phash(self):
+        """使用感知哈希查找相似图像"""
+        similarity_threshold = self.similarity_threshold
+        floor = self.similarity_floor(similarity_threshold)
+        if self.phash_search == "bktree":
+            # 加上余量后半径成倍增大，BK树几乎要访问所有节点；BK树只按当前阈值查询，不保存更低的边
+            floor = similarity_threshold
+        store = PackedHashStore(self.features.features)
+        rows, cols, similarities = [], [], []
+        
+        # 首先对完全相同的哈希值进行分组，组内记为100%相似
+        hash_groups = store.unique_groups()
+        for group in hash_groups:
+            rows.extend(group[:1] * (len(group) - 1))
+            cols.extend(group[1:])
+            similarities.extend([100.0] * (len(group) - 1))
+        
+        # 寻找相似的图像（不完全相同但相似度高），每种哈希值只需比较一次
+        if floor < 100:
+            unique = np.array([group[0] for group in hash_groups], dtype=np.int64)
+            unique_store = store.subset(unique)
+            max_distance = phash_max_distance(floor)
+            
+            search = self.phash_search
+            if search == "auto":
+                search = "mih" if len(unique) >= self.phash_index_min_images else "brute"
+            if search == "bktree":
+                matches_in = self._phash_bktree_matcher(unique_store, max_distance)
+            elif search == "mih":
+                matches_in = self._phash_mih_matcher(unique_store, max_distance)
+            else:
+                matches_in = self._phash_brute_matcher(unique_store, max_distance)
+            
+            def step(start, batch_size=1024):
+                end = min(start + batch_size, len(unique))
+                batch_rows, batch_cols, distances = matches_in(start, end)
+                return (end, unique[batch_rows], unique[batch_cols],
+                        (100 - (np.asarray(distances, dtype=np.float32) / PHASH_BITS * 100)).astype(np.float32))
+            
+            similar_rows, similar_cols, similar_similarities = self.resumable_edges(floor, len(unique), step)
+            rows.extend(similar_rows.tolist())
+            cols.extend(similar_cols.tolist())
+            similarities.extend(similar_similarities.tolist())
+        
+        self.similarity_graph = SimilarityGraph(self.features.paths, rows, cols, similarities, floor)
+    
+    @staticmethod
+    def _per_index_matcher(matches_for):
+        """把逐个哈希的查询包装成按下标区间查询，返回(行, 列, 距离)"""
+        def matches_in(start, end):
+            rows, cols, distances = [], [], []
+            for index in range(start, end):
+                matches, match_distances = matches_for(index)
+                rows.extend([index] * len(matches))
+                cols.extend(matches)
+                distances.extend(match_distances)
+            return (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64),
+                    np.array(distances, dtype=np.uint8))
+        return matches_in
+    
+    def _phash_bktree_matcher(self, store, max_distance):
+        """建立BK树索引，每张图片只检查阈值允许距离内的候选"""
+        tree = BKTree()
+        hash_ints = store.hashes.tolist()
+        for index, hash_int in enumerate(hash_ints):
+            tree.add(hash_int, index)
+        
+        def matches_for(index):
+            pairs = [(match, distance) for distance, match in tree.query(hash_ints[index], max_distance)
+                     if match > index]
+            return [match for match, _ in pairs], [distance for _, distance in pairs]
+        return self._per_index_matcher(matches_for)
+    
+    def _phash_mih_matcher(self, store, max_distance):
+        """多索引哈希：每段只探测距离max_distance//4以内的取值，再精确验证候选"""
+        index = MultiIndexHashStore(store.hashes)
+        return partial(index.query_range, max_distance=max_distance)
+    
+    def _phash_brute_matcher(self, store, max_distance):
+        """向量化暴力比较：一次将一个哈希与其后的全部哈希做异或+popcount"""
+        def matches_for(index):
+            return store.query(store.hashes[index], max_distance, start=index + 1)
+        return self._per_index_matcher(matches_for)
+    
+    def find_similar_images_histogram(self):
+        """使用直方图查找相似图像"""
+        similarity_threshold = self.similarity_threshold
+        floor = self.similarity_floor(similarity_threshold)
+        histograms = self.features.features
+        
+        if self.histogram_ann_min_images and len(histograms) >= self.histogram_ann_min_images:
+            # 图片很多时使用近似最近邻索引，只精确比较每张图片的top-k候选
+            matrix, constant = normalize_for_correlation(histograms)
+            index = HistogramIVFIndex(n_lists=self.histogram_ann_lists, n_probe=self.histogram_ann_probe)
+            index.load_or_build(matrix, os.path.join(CACHE_DIR, f"histogram_ivf_{self.folder_key()}.npz"))
+            rows, cols, similarities = index.similar_pairs(matrix, constant, floor, self.histogram_ann_top_k)
+        else:
+            # 分块矩阵乘法批量得到所有相似图像对，每个行块完成后可保存检查点
+            blocks = []
+            
+            def step(start):
+                if not blocks:
+                    blocks.append(histogram_similarity_blocks(histograms, floor, start_row=start))
+                _, end, block_rows, block_cols, block_similarities = next(blocks[0])
+                return end, block_rows, block_cols, block_similarities
+            
+            rows, cols, similarities = self.resumable_edges(floor, len(histograms), step)
+        
+        self.similarity_graph = SimilarityGraph(self.features.paths, rows, cols, similarities, floor)
+    
+    def find_similar_images_ssim(self):
+        """使用SSIM查找相似图像：默认只精确验证缩略图预筛选出的候选对；预筛选余量为None时精确计算所有图像对"""
+        similarity_threshold = self.similarity_threshold
+        floor = self.similarity_floor(similarity_threshold)
+        images = self.features.features
+        total = len(images)
+        
+        if self.ssim_prefilter_margin is None:
+            # 图像对按编号分块生成，各图像的窗口统计量只计算一次
+            self.report_status("正在计算图像统计量...")
+            stats = ssim_image_stats(images)
+            pair_count = total * (total - 1) // 2
+            
+            def pairs(start, end):
+                return upper_triangle_pairs(total, start, end)
+        else:
+            self.report_status("正在筛选候选图像...")
+            stats = None
+            rows, cols = ssim_candidate_pairs(images, floor / 50 - 1 - self.ssim_prefilter_margin)
+            pair_count = len(rows)
+            
+            def pairs(start, end):
+                return rows[start:end], cols[start:end]
+        
+        # 每次验证64批图像对，批次内按批报告进度，完成后可保存检查点
+        chunk_size = self.ssim_batch_size * 64
+        
+        def step(start):
+            end = min(start + chunk_size, pair_count)
+            chunk_edges = verify_ssim_pairs(
+                images, *pairs(start, end), floor, self.ssim_batch_size,
+                lambda done, _total: self.report_progress(start + done, pair_count, "比较中"), stats)
+            return (end,) + tuple(chunk_edges)
+        
+        rows, cols, similarities = self.resumable_edges(floor, pair_count, step)
+        self.similarity_graph = SimilarityGraph(self.features.paths, rows, cols, similarities, floor)
+    
+    def apply_changes(self, changed=(), deleted=(), moved=()):
+        """增量应用文件变化（新增或修改、删除、移动），只解码和比较变化的文件，返回包含这些文件的重复组"""
+        if self._matcher is None:
+            self._prepare_incremental()
+        changed = list(changed)
+        
+        for source, target in moved:
+            if os.path.splitext(target)[1].lower() not in SUPPORTED_FORMATS:
+                self._forget_path(source)
+            elif not self._rename_path(source, target):
+                changed.append(target)
+        for path in deleted:
+            self._forget_path(path)
+        
+        # 修改过的文件先移除旧节点，再作为新文件重新解码和比较
+        changed = [path for path in dict.fromkeys(changed)
+                   if os.path.splitext(path)[1].lower() in SUPPORTED_FORMATS]
+        for path in changed:
+            self._forget_path(path)
+        
+        # 本次移除的节点一次性从相似度图和比较索引中删除
+        if self._removed_nodes:
+            self.similarity_graph.remove_nodes(self._removed_nodes)
+            self._matcher.remove(self._removed_nodes)
+            self._removed_nodes = []
+        
+        # 新特征追加到特征库末尾，ID与相似度图的新节点下标一致
+        start = self.load_features(changed)
+        end = len(self.features)
+        self._node_index.update((self.features.paths[i], i) for i in range(start, end))
+        self.image_count += end - start
+        
+        graph = self.similarity_graph
+        self._matcher.sync()
+        graph.add_edges(*self._matcher.similar_pairs(start))
+        
+        groups = graph.component_groups(range(start, end), self.similarity_threshold)
+        return [self._with_copies(group) for group in groups]
+    
+    def _prepare_incremental(self):
+        """建立路径索引和按节点下标对齐的特征数组"""
+        if self.features is None:
+            self.features = FeatureStore(self.method, self.feature_memmap_dir)
+        if self.similarity_graph is None:
+            self.similarity_graph = SimilarityGraph(self.features.paths, [], [], [],
+                                                    self.similarity_floor(self.similarity_threshold))
+        paths = self.features.paths
+        self._node_index = {paths[i]: i for i in range(len(paths)) if paths[i] is not None}
+        self._identical_of = {path: group for group in self.identical_groups for path in group}
+        self._matcher = IncrementalMatcher(self.features, self.similarity_graph.floor, self.ssim_prefilter_margin)
+        self._matcher.sync()
+    
+    def _rename_node(self, source, target):
+        index = self._node_index.pop(source)
+        self._node_index[target] = index
+        self.features.paths[index] = target
+    
+    def _rename_path(self, source, target):
+        """文件被移动：内容未变，直接沿用原来的节点和特征；原路径未知时返回False"""
+        if source not in self._node_index and source not in self._identical_of:
+            return False
+        self._forget_path(target)
+        group = self._identical_of.pop(source, None)
+        if group is not None:
+            group[group.index(source)] = target
+            self._identical_of[target] = group
+        if source in self._node_index:
+            self._rename_node(source, target)
+        return True
+    
+    def _forget_path(self, path):
+        """从索引中移除文件；被移除的是字节相同文件组的代表时，由下一个副本接管它的节点"""
+        group = self._identical_of.pop(path, None)
+        if group is not None:
+            is_representative = group[0] == path
+            group.remove(path)
+            if len(group) == 1:
+                del self._identical_of[group[0]]
+                self.identical_groups.remove(group)
+            self.image_count -= 1
+            if is_representative and path in self._node_index:
+                self._rename_node(path, group[0])
+            return
+        
+        index = self._node_index.pop(path, None)
+        if index is None:
+            return
+        self._removed_nodes.append(index)
+        self.image_count -= 1
+    
+    def _with_copies(self, group):
+        expanded = []
+        for path in group:
+            expanded.append(path)
+            copies = self._identical_of.get(path)
+            if copies and copies[0] == path:
+                expanded.extend(copies[1:])
+        return expanded
+    
+    def iter_groups(self, similarity_threshold=None):
+        """按阈值逐组产出重复图像（含字节相同的副本）；阈值低于保存的下限时抛出ValueError"""
+        if similarity_threshold is None:
+            similarity_threshold = self.similarity_threshold
+        if self.similarity_graph is None:
+            yield from self.identical_groups
+            return
+        if similarity_threshold < self.similarity_graph.floor:
+            raise ValueError(f"阈值低于本次扫描保存的下限 {self.similarity_graph.floor:.0f}%")
+        groups = self.similarity_graph.iter_groups(similarity_threshold)
+        yield from iter_merged_groups(groups, self.identical_groups)
+
+
+# 批量处理计划中的一项：用keeper替换或删除path，size为预计释放的字节数；
+# keeper_size和keeper_digest是生成计划时保留文件的大小和摘要，执行前据此核对保留文件未被改动
+ReclaimItem = namedtuple("ReclaimItem", "keeper path size keeper_size keeper_digest")
+
+
+def keeper_sort_key(rule, index, path, stat):
+    """按保留规则排序的键，最小者保留；规则相同时保留组内靠前的文件"""
+    if rule == "oldest":
+        return (stat.st_mtime_ns, index)
+    if rule == "shortest":
+        return (len(path), index)
+    # 分辨率最高：只读取图像头部，不解码像素；分辨率相同时保留文件较大的
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        width = height = 0
+    return (-width * height, -stat.st_size, index)
+
+
+def same_content(keeper, path, digests):
+    """先比较大小再比较完整摘要；digests缓存保留文件的摘要，同一个保留文件只读取一次"""
+    try:
+        if os.path.getsize(keeper) != os.path.getsize(path):
+            return False
+        if keeper not in digests:
+            digests[keeper] = file_digest(keeper)
+        return file_digest(path) == digests[keeper]
+    except OSError:
+        return False
+
+
+def plan_reclaim(groups, rule="resolution", action="delete"):
+    """为每组选出保留的文件，产出其余文件的处理计划
+    
+    已不存在或与保留文件是同一inode的文件被跳过；替换为链接时只包含与保留文件字节完全相同的文件。
+    每组的保留文件读取一次摘要，供执行时核对
+    """
+    digests = {}
+    for group in groups:
+        candidates = []
+        for index, path in enumerate(group):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            candidates.append((keeper_sort_key(rule, index, path, stat), path, stat))
+        if len(candidates) < 2:
+            continue
+        
+        _, keeper, keeper_stat = min(candidates, key=lambda candidate: candidate[0])
+        try:
+            if keeper not in digests:
+                digests[keeper] = file_digest(keeper)
+        except OSError:
+            continue
+        for _, path, stat in candidates:
+            if (stat.st_dev, stat.st_ino) == (keeper_stat.st_dev, keeper_stat.st_ino):
+                continue
+            if action != "delete" and not same_content(keeper, path, digests):
+                continue
+            # 还有其他硬链接的文件处理后不会释放空间
+            yield ReclaimItem(keeper, path, stat.st_size if stat.st_nlink == 1 else 0,
+                              keeper_stat.st_size, digests[keeper])
+
+
+def replace_with_link(keeper, path, action):
+    """用keeper的硬链接或reflink原子替换path：先在同一目录创建临时文件，再用os.replace覆盖"""
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.reclaim-tmp")
+    try:
+        if action == "hardlink":
+            os.link(keeper, temp_path)
+        else:
+            if fcntl is None:
+                raise OSError(errno.EOPNOTSUPP, "当前系统不支持reflink")
+            with open(keeper, "rb") as source, open(temp_path, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SpaceReclaimer:
+    """按计划批量删除重复文件或替换为链接，每个操作追加到JSONL日志
+    
+    日志按批写入并在结束时落盘，记录每个文件的处理方式、保留文件和释放的字节数，
+    可用于事后核对。处理每组之前先核对保留文件仍存在且大小和摘要与计划时相同，否则跳过整组；
+    硬链接和reflink只在内容与保留文件完全相同时执行
+    """
+
+    def __init__(self, action="delete", journal_path=None, progress_callback=None, check_cancelled=None,
+                 journal_flush_interval=1.0):
+        if action not in RECLAIM_ACTIONS:
+            raise ValueError(f"未知的处理方式: {action}")
+        self.action = action
+        self.journal_path = journal_path or os.path.join(
+            RECLAIM_JOURNAL_DIR, time.strftime("reclaim_%Y%m%d_%H%M%S.jsonl"))
+        self.progress_callback = progress_callback  # progress_callback(已完成数, 总数, 阶段)
+        self.check_cancelled = check_cancelled  # 每个文件处理前调用，可抛出ScanCancelled中止
+        self.journal_flush_interval = journal_flush_interval
+        self._keeper_digests = {}
+        self._keeper_intact = {}  # 保留文件 -> 是否与计划时相同，每个保留文件只核对一次
+
+    def keeper_intact(self, item):
+        """保留文件仍存在，且大小和完整摘要与生成计划时相同"""
+        if item.keeper not in self._keeper_intact:
+            try:
+                intact = (os.path.getsize(item.keeper) == item.keeper_size
+                          and file_digest(item.keeper) == item.keeper_digest)
+            except OSError:
+                intact = False
+            if intact:
+                self._keeper_digests[item.keeper] = item.keeper_digest
+            self._keeper_intact[item.keeper] = intact
+        return self._keeper_intact[item.keeper]
+
+    def run(self, items):
+        """执行处理计划，返回(已处理数, 释放的字节数, 错误列表[(路径, 错误信息)])"""
+        items = list(items)
+        total = len(items)
+        done_count = reclaimed = 0
+        errors = []
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            last_flush = time.time()
+            try:
+                for i, item in enumerate(items):
+                    if self.check_cancelled is not None:
+                        self.check_cancelled()
+                    record = {"time": time.time(), "action": self.action, "path": item.path,
+                              "keeper": item.keeper, "size": item.size}
+                    try:
+                        # 生成计划后文件可能已变化：保留文件丢失或改动时不能删除其余副本，替换前也重新核对内容
+                        if not self.keeper_intact(item):
+                            raise ValueError("保留文件已不存在或内容已变化，跳过本组")
+                        if self.action == "delete":
+                            os.remove(item.path)
+                        elif not same_content(item.keeper, item.path, self._keeper_digests):
+                            raise ValueError("内容与保留文件不同，跳过")
+                        else:
+                            replace_with_link(item.keeper, item.path, self.action)
+                        done_count += 1
+                        reclaimed += item.size
+                    except (OSError, ValueError) as e:
+                        errors.append((item.path, str(e)))
+                        record["error"] = str(e)
+                    journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    
+                    now = time.time()
+                    if now - last_flush >= self.journal_flush_interval:
+                        journal.flush()
+                        last_flush = now
+                        if self.progress_callback is not None:
+                            self.progress_callback(i + 1, total, "处理中")
+            finally:
+                journal.flush()
+                os.fsync(journal.fileno())
+        
+        if self.progress_callback is not None:
+            self.progress_callback(total, total, "处理中")
+        return done_count, reclaimed, errors
+
+
+def format_size(size):
+    """把字节数格式化为KB/MB/GB"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def write_reclaim_report(items, output, action):
+    """试运行报告：每行一个待处理文件及其保留文件，最后给出总数和预计释放的空间"""
+    count = total_size = 0
+    for count, item in enumerate(items, 1):
+        total_size += item.size
+        output.write(f"{RECLAIM_ACTIONS[action]}\t{item.path}\t保留\t{item.keeper}\t{item.size}\n")
+    output.write(f"共 {count} 个文件，预计释放 {format_size(total_size)}\n")
+    output.flush()
+    return count, total_size
+
+
+def render_thumbnail(path, size=THUMBNAIL_SIZE):
+    """按纵横比缩放到size以内；JPEG先用草稿模式按接近目标的尺寸解码，避免解出整张大图"""
+    with Image.open(path) as img:
+        width, height = img.size
+        ratio = min(size[0] / width, size[1] / height)
+        target = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+        has_alpha = "A" in img.getbands() or (img.mode == "P" and "transparency" in img.info)
+        img.draft("RGB", target)
+        return img.convert("RGBA" if has_alpha else "RGB").resize(target, Image.LANCZOS)
+
+
+class ThumbnailService:
+    """后台生成缩略图：线程池草稿解码，结果放入按字节数限制的LRU缓存，可选持久化到磁盘
+    
+    request/prefetch立即返回，生成完成后在工作线程中调用回调；
+    get只查内存缓存，不会阻塞界面线程。磁盘缓存同样有字节上限，超出时按最近使用时间淘汰
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, max_bytes=256 * 1024 * 1024, workers=4, disk_cache_dir=None,
+                 disk_max_bytes=512 * 1024 * 1024):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.disk_cache_dir = disk_cache_dir  # None表示只缓存在内存中
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_lock = threading.Lock()  # 只在工作线程中使用，统计和清理磁盘缓存时不阻塞界面线程
+        self.disk_bytes = None  # 磁盘缓存的总字节数，首次写入时统计
+        if disk_cache_dir:
+            os.makedirs(disk_cache_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # 路径 -> PIL缩略图，按最近使用排序
+        self.file_sizes = {}  # 路径 -> 文件字节数，在工作线程中读取，与缩略图一同缓存和淘汰
+        self.cache_bytes = 0
+        self.pending = {}  # 路径 -> Future
+        self.callbacks = defaultdict(list)
+
+    def file_size(self, path):
+        """返回生成缩略图时读取的文件大小，未知时返回None"""
+        with self.lock:
+            return self.file_sizes.get(path)
+
+    def get(self, path):
+        """返回内存中已有的缩略图，没有时返回None"""
+        with self.lock:
+            thumb = self.cache.get(path)
+            if thumb is not None:
+                self.cache.move_to_end(path)
+            return thumb
+
+    def request(self, path, callback=None):
+        """提交生成任务；callback(路径, 缩略图或异常)在工作线程中调用"""
+        with self.lock:
+            thumb = self.cache.get(path)
+            if thumb is None:
+                if callback is not None:
+                    self.callbacks[path].append(callback)
+                if path not in self.pending:
+                    self.pending[path] = self.executor.submit(self._load, path)
+                return
+            self.cache.move_to_end(path)
+        if callback is not None:
+            callback(path, thumb)
+
+    def prefetch(self, paths):
+        for path in paths:
+            self.request(path)
+
+    def cancel_pending(self, keep=()):
+        """取消尚未开始、且不在keep中的任务，翻页后优先生成新页面需要的缩略图"""
+        keep = set(keep)
+        with self.lock:
+            for path, future in list(self.pending.items()):
+                if path not in keep and future.cancel():
+                    del self.pending[path]
+                    self.callbacks.pop(path, None)
+
+    def discard(self, path):
+        with self.lock:
+            thumb = self.cache.pop(path, None)
+            self.file_sizes.pop(path, None)
+            if thumb is not None:
+                self.cache_bytes -= self._image_bytes(thumb)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _image_bytes(thumb):
+        return thumb.width * thumb.height * len(thumb.getbands())
+
+    def _disk_path(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size[0]}x{self.size[1]}"
+        return os.path.join(self.disk_cache_dir, hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest())
+
+    def _render(self, path):
+        if not self.disk_cache_dir:
+            return render_thumbnail(path, self.size)
+        
+        # 磁盘缓存以路径、大小和修改时间为键，文件变化后自动失效；不透明图像存JPEG，透明图像存PNG
+        disk_path = self._disk_path(path)
+        for extension in (".jpg", ".png"):
+            try:
+                with Image.open(disk_path + extension) as cached:
+                    cached.load()
+                # 以修改时间记录最近使用，清理时先淘汰最久未用的
+                os.utime(disk_path + extension)
+                return cached
+            except OSError:
+                continue
+        
+        thumb = render_thumbnail(path, self.size)
+        try:
+            disk_path += ".png" if thumb.mode == "RGBA" else ".jpg"
+            if thumb.mode == "RGBA":
+                thumb.save(disk_path)
+            else:
+                thumb.save(disk_path, quality=90)
+            self._add_disk_bytes(os.path.getsize(disk_path))
+        except OSError:
+            pass
+        return thumb
+
+    def _add_disk_bytes(self, size):
+        """记录新写入的缓存文件；总大小超过上限时删除最久未用的文件，直到降到上限的80%"""
+        with self.disk_lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.disk_cache_dir)
+                                      if entry.is_file())
+            else:
+                self.disk_bytes += size
+            if self.disk_bytes <= self.disk_max_bytes:
+                return
+            
+            entries = sorted((entry.stat().st_mtime_ns, entry.path, entry.stat().st_size)
+                             for entry in os.scandir(self.disk_cache_dir) if entry.is_file())
+            self.disk_bytes = sum(size for _, _, size in entries)
+            for _, path, size in entries:
+                if self.disk_bytes <= self.disk_max_bytes * 0.8:
+                    break
+                try:
+                    os.remove(path)
+                    self.disk_bytes -= size
+                except OSError:
+                    pass
+
+    def _load(self, path):
+        try:
+            file_size = os.path.getsize(path)
+            result = self._render(path)
+        except Exception as e:
+            result = e
+        
+        with self.lock:
+            self.pending.pop(path, None)
+            callbacks = self.callbacks.pop(path, [])
+            if not isinstance(result, Exception) and path not in self.cache:
+                self.cache[path] = result
+                self.file_sizes[path] = file_size
+                self.cache_bytes += self._image_bytes(result)
+                # 超出字节上限时淘汰最久未使用的缩略图
+                while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+                    evicted_path, evicted = self.cache.popitem(last=False)
+                    self.file_sizes.pop(evicted_path, None)
+                    self.cache_bytes -= self._image_bytes(evicted)
+        
+        for callback in callbacks:
+            callback(path, result)
+
+
+class ThumbnailCell:
+    """虚拟网格中可复用的单元格：缩略图、文件信息和删除按钮，滚出视口后换绑到其他图像"""
+
+    def __init__(self, canvas, on_delete):
+        self.canvas = canvas
+        self.path = None
+        self.tk_img = None  # 保持引用以避免垃圾回收
+        self.frame = ttk.Frame(canvas, borderwidth=2, relief="groove",
+                               width=GRID_CELL_SIZE[0] - 10, height=GRID_CELL_SIZE[1] - 10)
+        self.frame.pack_propagate(False)
+        self.image_label = ttk.Label(self.frame, anchor="center")
+        self.image_label.pack(padx=5, pady=5)
+        self.info_label = ttk.Label(self.frame, wraplength=200)
+        self.info_label.pack(padx=5)
+        delete_button = ttk.Button(self.frame, text="删除", command=lambda: on_delete(self.path))
+        delete_button.pack(pady=5)
+        # 鼠标在单元格上时滚轮同样滚动网格
+        for widget in (self.frame, self.image_label, self.info_label, delete_button):
+            widget.bindtags((GRID_SCROLL_TAG,) + widget.bindtags())
+        self.window = canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+
+    def show(self, path, x, y):
+        self.path = path
+        self.tk_img = None
+        self.image_label.configure(image="", text="加载中...")
+        self.set_info()
+        self.canvas.coords(self.window, x + 5, y + 5)
+        self.canvas.itemconfigure(self.window, state="normal")
+
+    def hide(self):
+        self.path = None
+        self.tk_img = None
+        self.image_label.configure(image="")
+        self.canvas.itemconfigure(self.window, state="hidden")
+
+    def set_info(self, file_size=None):
+        """显示文件名和大小；大小由缩略图工作线程读取，界面线程不访问文件系统"""
+        file_name = os.path.basename(self.path)
+        if file_size is None:
+            self.info_label.configure(text=f"文件名: {file_name}")
+        else:
+            self.info_label.configure(text=f"文件名: {file_name}\n大小: {file_size / 1024:.1f} KB")
+
+    def set_thumbnail(self, thumb, file_size=None):
+        # 创建Tkinter图像
+        self.tk_img = ImageTk.PhotoImage(thumb)
+        self.image_label.configure(image=self.tk_img, text="")
+        self.set_info(file_size)
+
+    def set_error(self, error):
+        self.image_label.configure(text=f"无法加载图像\n{os.path.basename(self.path)}\n错误: {str(error)}",
+                                   wraplength=200)
+
 
 class ImageDuplicateFinder:
     def __init__(self, root):
@@ -28,19 +2665,35 @@ class ImageDuplicateFinder:
         self.status_text.set("就绪")
         self.similarity_threshold = tk.IntVar(value=90)  # 默认相似度阈值为90%
         self.comparison_method = tk.StringVar(value="phash")  # 默认使用感知哈希
+        self.worker_count = tk.IntVar(value=os.cpu_count() or 1)  # 特征提取的并行进程数
+        self.fast_decode = tk.BooleanVar(value=True)  # JPEG缩放解码，取消勾选则按原图精确解码
+        self.keep_rule = tk.StringVar(value=KEEP_RULES["resolution"])  # 批量处理时每组保留的文件
+        self.reclaim_action = tk.StringVar(value=RECLAIM_ACTIONS["delete"])  # 批量处理其余文件的方式
         
         # 创建UI组件
         self.create_widgets()
         
         # 存储数据
-        self.image_hashes = {}  # 保存图像哈希值或直方图
-        self.image_data = {}    # 保存图像数据(用于SSIM)
+        self.engine = None  # 最近一次扫描使用的引擎，保存特征和相似度边表
+        self.progress_channel = None  # 扫描线程写入、界面定时读取的进度通道
+        self.scan_thread = None
         self.duplicate_groups = []  # 保存找到的重复图像组
+        self._regroup_job = None
         self.current_group_index = 0  # 当前查看的重复组索引
         
-        # 当前显示的图像
-        self.current_images = []
-        self.current_image_paths = []
+        # 当前显示的图像：只为可见行创建单元格，滚动时复用
+        self.thumbnails = ThumbnailService(disk_cache_dir=THUMBNAIL_CACHE_DIR)
+        # 缩略图工作线程同样通过进度通道回到界面线程；该通道不关闭，窗口存在期间一直轮询
+        self.thumbnail_channel = ProgressChannel()
+        self.thumbnail_channel.attach(self.root)
+        self.grid_canvas = None
+        self.grid_cells = {}  # 组内下标 -> 正在显示的单元格
+        self.free_cells = []  # 滚出视口、等待复用的单元格
+        self.prefetch_paths = []  # 预取的相邻组图像
+        self.prefetch_limit = 60  # 预取相邻组时每组最多生成的缩略图数
+        
+        # 关闭窗口时先取消扫描，让扫描线程保存检查点并关闭工作进程
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def create_widgets(self):
         # 顶部框架 - 文件夹选择
@@ -69,17 +2722,35 @@ class ImageDuplicateFinder:
         
         ttk.Label(similarity_frame, text="相似度阈值:").pack(side="left", padx=5)
         ttk.Scale(similarity_frame, from_=1, to=100, variable=self.similarity_threshold, 
-                 orient="horizontal", length=300).pack(side="left", padx=5)
+                 orient="horizontal", length=300, command=self.on_threshold_change).pack(side="left", padx=5)
         ttk.Label(similarity_frame, text=lambda: f"{self.similarity_threshold.get()}%").pack(side="left")
         
+        ttk.Label(similarity_frame, text="并行进程数:").pack(side="left", padx=(20, 5))
+        ttk.Spinbox(similarity_frame, from_=1, to=max(64, os.cpu_count() or 1), 
+                   textvariable=self.worker_count, width=5).pack(side="left")
+        ttk.Checkbutton(similarity_frame, text="快速解码", 
+                       variable=self.fast_decode).pack(side="left", padx=10)
+        
         # 按钮框架
         button_frame = ttk.Frame(self.root, padding=10)
         button_frame.pack(fill="x")
         
         ttk.Button(button_frame, text="扫描图片", command=self.start_scan).pack(side="left", padx=5)
+        self.pause_button = ttk.Button(button_frame, text="暂停", command=self.toggle_pause, state="disabled")
+        self.pause_button.pack(side="left", padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="取消", command=self.cancel_scan, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
         ttk.Button(button_frame, text="上一组", command=self.show_previous_group).pack(side="left", padx=5)
         ttk.Button(button_frame, text="下一组", command=self.show_next_group).pack(side="left", padx=5)
         
+        # 批量处理：按规则保留每组一个文件，其余删除或替换为链接
+        ttk.Button(button_frame, text="批量处理...", command=self.start_reclaim).pack(side="right", padx=5)
+        ttk.Combobox(button_frame, textvariable=self.reclaim_action, values=list(RECLAIM_ACTIONS.values()),
+                     state="readonly", width=12).pack(side="right", padx=5)
+        ttk.Combobox(button_frame, textvariable=self.keep_rule, values=list(KEEP_RULES.values()),
+                     state="readonly", width=12).pack(side="right", padx=5)
+        ttk.Label(button_frame, text="保留:").pack(side="right")
+        
         # 状态栏
         status_bar = ttk.Label(self.root, textvariable=self.status_text, relief="sunken", anchor="w")
         status_bar.pack(side="bottom", fill="x")
@@ -92,6 +2763,11 @@ class ImageDuplicateFinder:
         self.progress = ttk.Progressbar(self.root, orient="horizontal", length=200, mode="determinate")
         self.progress.pack(side="bottom", fill="x", padx=10, pady=5)
         
+        # 鼠标滚轮滚动图像网格（Windows/macOS为MouseWheel，X11为Button-4/5）；
+        # 只绑定到网格画布和单元格共用的标签，其他控件和对话框中的滚轮不受影响
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.root.bind_class(GRID_SCROLL_TAG, sequence, self.on_mouse_wheel)
+        
     def browse_folder(self):
         folder_selected = filedialog.askdirectory()
         if folder_selected:
@@ -99,6 +2775,8 @@ class ImageDuplicateFinder:
             self.status_text.set(f"已选择文件夹: {folder_selected}")
     
     def start_scan(self):
+        if self.scan_thread is not None and self.scan_thread.is_alive():
+            return
         if not self.folder_path.get():
             messagebox.showerror("错误", "请先选择一个文件夹")
             return
@@ -110,12 +2788,57 @@ class ImageDuplicateFinder:
         self.duplicate_groups = []
         self.current_group_index = 0
         
-        # 使用线程避免界面冻结
+        # 使用线程避免界面冻结；扫描线程只写入进度通道，界面每100毫秒合并刷新一次
         method = self.comparison_method.get()
+        self.progress_channel = ProgressChannel()
+        self.progress_channel.attach(self.root, self.show_scan_progress)
+        self.engine = DuplicateScanEngine(
+            method=method,
+            similarity_threshold=self.similarity_threshold.get(),
+            worker_count=self.worker_count.get(),
+            fast_decode=self.fast_decode.get(),
+            progress_callback=self.on_scan_progress,
+            status_callback=self.progress_channel.set_status
+        )
         self.status_text.set(f"开始扫描图片... 使用{self.get_method_name(method)}算法")
-        scan_thread = threading.Thread(target=self.scan_images)
-        scan_thread.daemon = True
-        scan_thread.start()
+        self.pause_button.configure(text="暂停", state="normal")
+        self.cancel_button.configure(state="normal")
+        self.scan_thread = threading.Thread(target=self.scan_images)
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+    
+    def toggle_pause(self):
+        """暂停后扫描线程在下一次报告进度时等待，已提交给工作进程的少量文件块完成后不再提交新任务"""
+        if self.engine is None:
+            return
+        if self.engine.paused:
+            self.engine.resume()
+            self.pause_button.configure(text="暂停")
+        else:
+            self.engine.pause()
+            self.pause_button.configure(text="继续")
+            self.status_text.set("已暂停")
+    
+    def cancel_scan(self):
+        if self.engine is not None:
+            self.engine.cancel()
+            self.status_text.set("正在取消扫描...")
+    
+    def on_close(self):
+        if self.scan_thread is not None and self.scan_thread.is_alive():
+            self.engine.cancel()
+            self.scan_thread.join(timeout=10)
+        self.root.destroy()
+    
+    def on_scan_progress(self, done, total, stage):
+        """引擎进度回调（在扫描线程中调用），只记录最新进度，不向Tk投递事件"""
+        self.progress_channel.update(done, total, stage, "张" if stage == "扫描中" else "对")
+    
+    def show_scan_progress(self, snapshot):
+        """按固定节拍在主线程中显示进度、速率和剩余时间"""
+        if snapshot.total:
+            self.progress.configure(value=snapshot.done / snapshot.total * 100)
+        self.status_text.set(snapshot.status)
     
     def get_method_name(self, method):
         if method == "phash":
@@ -126,236 +2849,62 @@ class ImageDuplicateFinder:
             return "结构相似性(SSIM)"
         return "未知"
     
-    def calculate_histogram(self, img):
-        """计算彩色图像的直方图特征"""
-        # 将图像转换为BGR格式（OpenCV使用BGR）
-        img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-        
-        # 转换为HSV空间
-        hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
-        
-        # 计算HSV直方图
-        hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 8, 8], [0, 180, 0, 256, 0, 256])
-        
-        # 归一化直方图
-        cv2.normalize(hist, hist, 0, 1.0, cv2.NORM_MINMAX)
-        
-        return hist.flatten()
-    
-    def compare_histograms(self, hist1, hist2):
-        """比较两个直方图，返回相似度百分比"""
-        # 使用相关性方法比较直方图
-        # 相关性方法返回范围为[-1, 1]的值，1表示完全匹配
-        correlation = cv2.compareHist(hist1.reshape(-1, 1), hist2.reshape(-1, 1), cv2.HISTCMP_CORREL)
-        
-        # 将相关性转换为百分比相似度(范围0-100)
-        similarity = max(0, (correlation + 1) / 2 * 100)
-        
-        return similarity
-    
-    def prepare_for_ssim(self, img):
-        """准备图像用于SSIM比较，统一大小并转为灰度"""
-        # 调整图像大小为标准尺寸(64x64)
-        img_resized = img.resize((64, 64), Image.LANCZOS)
-        
-        # 转换为灰度图
-        if img_resized.mode != 'L':
-            img_gray = img_resized.convert('L')
-        else:
-            img_gray = img_resized
+    def scan_images(self):
+        """在后台线程中运行扫描引擎，完成后回到主线程显示结果"""
+        channel = self.progress_channel
+        try:
+            groups = self.engine.scan([self.folder_path.get()])
+            if not self.engine.image_count:
+                channel.post(messagebox.showinfo, "结果", "文件夹中没有图像文件")
+                channel.post(self.status_text.set, "扫描完成：没有找到图像")
+                return
             
-        # 转换为numpy数组
-        return np.array(img_gray)
-    
-    def compare_ssim(self, img1, img2):
-        """使用SSIM比较两个图像，返回相似度百分比"""
-        # 计算SSIM，范围为[-1, 1]
-        ssim_score = ssim(img1, img2)
-        
-        # 转换为百分比相似度(范围0-100)
-        similarity = max(0, (ssim_score + 1) / 2 * 100)
-        
-        return similarity
+            # 更新UI
+            channel.post(self.finish_scan, groups)
+        except ScanCancelled:
+            channel.post(self.status_text.set, "扫描已取消，已提取的特征已保存，重新扫描将从中断处继续")
+        finally:
+            channel.post(self.end_scan)
+            channel.close()
     
-    def scan_images(self):
-        folder = self.folder_path.get()
-        self.image_hashes = {}
-        self.image_data = {}
-        method = self.comparison_method.get()
-        
-        # 获取所有图像文件
-        all_files = []
-        supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff'}
-        
-        for root, _, files in os.walk(folder):
-            for file in files:
-                if os.path.splitext(file)[1].lower() in supported_formats:
-                    all_files.append(os.path.join(root, file))
-        
-        total_files = len(all_files)
-        if total_files == 0:
-            self.root.after(0, lambda: messagebox.showinfo("结果", "文件夹中没有图像文件"))
-            self.root.after(0, lambda: self.status_text.set("扫描完成：没有找到图像"))
-            return
-        
-        # 计算每个图像的特征（哈希值或直方图或SSIM数据）
-        for i, file_path in enumerate(all_files):
-            try:
-                # 更新进度
-                progress_percent = (i + 1) / total_files * 100
-                self.root.after(0, lambda p=progress_percent: self.progress.configure(value=p))
-                self.root.after(0, lambda m=f"扫描中... {i+1}/{total_files}": self.status_text.set(m))
-                
-                # 根据所选方法计算特征
-                with Image.open(file_path) as img:
-                    if method == "phash":
-                        # 使用感知哈希
-                        feature = imagehash.phash(img)
-                        self.image_hashes[file_path] = feature
-                    elif method == "histogram":
-                        # 使用颜色直方图
-                        feature = self.calculate_histogram(img)
-                        self.image_hashes[file_path] = feature
-                    else:  # ssim
-                        # 为SSIM准备图像数据
-                        img_data = self.prepare_for_ssim(img)
-                        self.image_data[file_path] = img_data
-            except Exception as e:
-                print(f"无法处理文件 {file_path}: {e}")
-        
-        # 查找相似图像
-        if method == "phash":
-            self.find_similar_images_phash()
-        elif method == "histogram":
-            self.find_similar_images_histogram()
-        else:  # ssim
-            self.find_similar_images_ssim()
-        
-        # 更新UI
-        self.root.after(0, lambda: self.progress.configure(value=100))
-        self.root.after(0, lambda: self.show_results())
+    def end_scan(self):
+        self.pause_button.configure(text="暂停", state="disabled")
+        self.cancel_button.configure(state="disabled")
     
-    def find_similar_images_phash(self):
-        """使用感知哈希查找相似图像"""
-        similarity_threshold = self.similarity_threshold.get()
-        hash_dict = defaultdict(list)
-        
-        # 首先对完全相同的哈希值进行分组
-        for path, hash_value in self.image_hashes.items():
-            hash_dict[hash_value].append(path)
-        
-        # 收集完全相同的图像
-        exact_duplicates = [paths for paths in hash_dict.values() if len(paths) > 1]
-        
-        # 寻找相似的图像（不完全相同但相似度高）
-        if similarity_threshold < 100:
-            remaining_images = [path for paths in hash_dict.values() if len(paths) == 1 for path in paths]
-            similarity_groups = []
-            
-            while remaining_images:
-                current = remaining_images[0]
-                current_hash = self.image_hashes[current]
-                similar = [current]
-                
-                i = 1
-                while i < len(remaining_images):
-                    compare_path = remaining_images[i]
-                    compare_hash = self.image_hashes[compare_path]
-                    
-                    # 计算哈希之间的差异
-                    hash_diff = current_hash - compare_hash
-                    max_diff = 64  # 64位哈希的最大差异
-                    similarity = 100 - (hash_diff / max_diff * 100)
-                    
-                    if similarity >= similarity_threshold:
-                        similar.append(compare_path)
-                        remaining_images.pop(i)
-                    else:
-                        i += 1
-                
-                remaining_images.pop(0)
-                if len(similar) > 1:
-                    similarity_groups.append(similar)
-            
-            # 合并完全相同和相似的图像组
-            self.duplicate_groups = exact_duplicates + similarity_groups
-        else:
-            self.duplicate_groups = exact_duplicates
+    def finish_scan(self, groups):
+        self.progress.configure(value=100)
+        self.duplicate_groups = groups
+        self.show_results()
     
-    def find_similar_images_histogram(self):
-        """使用直方图查找相似图像"""
-        similarity_threshold = self.similarity_threshold.get()
-        image_paths = list(self.image_hashes.keys())
-        
-        self.duplicate_groups = []
-        processed = set()
-        
-        for i, path1 in enumerate(image_paths):
-            if path1 in processed:
-                continue
-                
-            hist1 = self.image_hashes[path1]
-            similar_group = [path1]
-            processed.add(path1)
-            
-            for path2 in image_paths[i+1:]:
-                if path2 in processed:
-                    continue
-                    
-                hist2 = self.image_hashes[path2]
-                similarity = self.compare_histograms(hist1, hist2)
-                
-                if similarity >= similarity_threshold:
-                    similar_group.append(path2)
-                    processed.add(path2)
-            
-            if len(similar_group) > 1:
-                self.duplicate_groups.append(similar_group)
+    def on_threshold_change(self, _value=None):
+        """拖动阈值滑块后稍作延迟再重新分组，避免拖动过程中反复计算"""
+        if self.engine is None or self.engine.similarity_graph is None:
+            return
+        if self._regroup_job is not None:
+            self.root.after_cancel(self._regroup_job)
+        self._regroup_job = self.root.after(150, self.regroup)
     
-    def find_similar_images_ssim(self):
-        """使用SSIM查找相似图像"""
-        similarity_threshold = self.similarity_threshold.get()
-        image_paths = list(self.image_data.keys())
-        
-        self.duplicate_groups = []
-        processed = set()
-        
-        # 更新状态为开始比较
-        self.root.after(0, lambda: self.status_text.set("正在比较图像相似度..."))
+    def regroup(self):
+        """用已保存的相似度边表按新阈值重新分组，无需重新提取特征和比较"""
+        self._regroup_job = None
+        if self.scan_thread is not None and self.scan_thread.is_alive():
+            # 后台线程正在更新相似度图（如批量删除后），完成后再分组
+            self._regroup_job = self.root.after(150, self.regroup)
+            return
+        try:
+            self.duplicate_groups = list(self.engine.iter_groups(self.similarity_threshold.get()))
+        except ValueError as e:
+            self.status_text.set(f"{e}，请重新扫描")
+            return
         
-        total_comparisons = len(image_paths) * (len(image_paths) - 1) // 2
-        comparison_count = 0
+        self.current_group_index = 0
+        for widget in self.image_frame.winfo_children():
+            widget.destroy()
         
-        for i, path1 in enumerate(image_paths):
-            if path1 in processed:
-                continue
-                
-            img1 = self.image_data[path1]
-            similar_group = [path1]
-            processed.add(path1)
-            
-            for j, path2 in enumerate(image_paths[i+1:], i+1):
-                if path2 in processed:
-                    continue
-                
-                # 更新进度
-                comparison_count += 1
-                if comparison_count % 10 == 0:  # 每10次比较更新一次，避免UI过度更新
-                    progress = min(100, comparison_count / total_comparisons * 100)
-                    self.root.after(0, lambda p=progress: self.progress.configure(value=p))
-                    self.root.after(0, lambda c=comparison_count, t=total_comparisons: 
-                                   self.status_text.set(f"比较中... {c}/{t}"))
-                
-                # 比较图像
-                img2 = self.image_data[path2]
-                similarity = self.compare_ssim(img1, img2)
-                
-                if similarity >= similarity_threshold:
-                    similar_group.append(path2)
-                    processed.add(path2)
-            
-            if len(similar_group) > 1:
-                self.duplicate_groups.append(similar_group)
+        if not self.duplicate_groups:
+            self.status_text.set("未找到重复图像")
+            return
+        self.show_results()
     
     def show_results(self):
         if not self.duplicate_groups:
@@ -384,78 +2933,109 @@ class ImageDuplicateFinder:
         # 更新状态
         self.status_text.set(f"显示第 {group_index + 1}/{len(self.duplicate_groups)} 组 - {len(group)} 张相似图片")
         
-        # 重置当前显示
-        self.current_images = []
-        self.current_image_paths = []
-        
         # 创建一个画布框架
         canvas_frame = ttk.Frame(self.image_frame)
         canvas_frame.pack(fill="both", expand=True)
         
         # 创建画布和滚动条
-        canvas = tk.Canvas(canvas_frame)
+        canvas = tk.Canvas(canvas_frame, yscrollincrement=GRID_CELL_SIZE[1] // 4)
         scrollbar_y = ttk.Scrollbar(canvas_frame, orient="vertical", command=canvas.yview)
         scrollbar_x = ttk.Scrollbar(canvas_frame, orient="horizontal", command=canvas.xview)
         
-        # 配置画布
-        canvas.configure(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
+        # 配置画布：视图变化时同步滚动条并更新可见单元格
+        canvas.configure(yscrollcommand=partial(self.on_grid_scroll, scrollbar_y), xscrollcommand=scrollbar_x.set)
         scrollbar_y.pack(side="right", fill="y")
         scrollbar_x.pack(side="bottom", fill="x")
         canvas.pack(side="left", fill="both", expand=True)
+        canvas.bind("<Configure>", lambda e: self.update_visible_cells())
+        canvas.bindtags((GRID_SCROLL_TAG,) + canvas.bindtags())
         
-        # 创建显示框架
-        display_frame = ttk.Frame(canvas)
-        canvas.create_window((0, 0), window=display_frame, anchor="nw")
+        self.grid_canvas = canvas
+        self.grid_cells = {}
+        self.free_cells = []
+        self.prefetch_adjacent_groups(group_index)
+        self.layout_grid()
+    
+    def layout_grid(self):
+        """按当前组的成员数设置滚动区域，并重新绑定可见单元格；删除图像后无需重建网格"""
+        group = self.duplicate_groups[self.current_group_index]
+        rows = -(-len(group) // GRID_COLUMNS)
+        self.grid_canvas.configure(scrollregion=(0, 0, GRID_COLUMNS * GRID_CELL_SIZE[0], rows * GRID_CELL_SIZE[1]))
+        for cell in self.grid_cells.values():
+            cell.hide()
+            self.free_cells.append(cell)
+        self.grid_cells = {}
+        self.update_visible_cells()
+    
+    def update_visible_cells(self):
+        """只为视口内的行（上下各多留一行）绑定单元格，滚出视口的单元格放回空闲列表复用"""
+        canvas = self.grid_canvas
+        if canvas is None or not canvas.winfo_exists() or not self.duplicate_groups:
+            return
+        group = self.duplicate_groups[self.current_group_index]
+        cell_width, cell_height = GRID_CELL_SIZE
+        top = canvas.canvasy(0)
+        height = max(canvas.winfo_height(), cell_height)
+        first_row = max(0, int(top // cell_height) - 1)
+        last_row = int((top + height) // cell_height) + 1
+        visible = range(first_row * GRID_COLUMNS, min(len(group), (last_row + 1) * GRID_COLUMNS))
         
-        # 每行显示的图像数
-        images_per_row = 3
-        max_height = 200
+        for index in [index for index in self.grid_cells if index not in visible]:
+            cell = self.grid_cells.pop(index)
+            cell.hide()
+            self.free_cells.append(cell)
         
-        # 显示每个图像
-        for i, img_path in enumerate(group):
-            row = i // images_per_row
-            col = i % images_per_row
-            
-            # 创建图像框架
-            img_frame = ttk.Frame(display_frame, borderwidth=2, relief="groove")
-            img_frame.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-            
-            try:
-                # 打开并调整图像大小
-                with Image.open(img_path) as img:
-                    # 保持纵横比调整大小
-                    width, height = img.size
-                    ratio = min(200 / width, max_height / height)
-                    new_width = int(width * ratio)
-                    new_height = int(height * ratio)
-                    img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-                    
-                    # 创建Tkinter图像
-                    tk_img = ImageTk.PhotoImage(img_resized)
-                    self.current_images.append(tk_img)  # 保持引用以避免垃圾回收
-                    self.current_image_paths.append(img_path)
-                    
-                    # 显示图像
-                    img_label = ttk.Label(img_frame, image=tk_img)
-                    img_label.pack(padx=5, pady=5)
-                    
-                    # 显示文件名和大小
-                    file_name = os.path.basename(img_path)
-                    file_size = os.path.getsize(img_path) / 1024  # KB
-                    
-                    info_text = f"文件名: {file_name}\n大小: {file_size:.1f} KB"
-                    ttk.Label(img_frame, text=info_text, wraplength=200).pack(padx=5)
-                    
-                    # 添加删除按钮
-                    ttk.Button(img_frame, text="删除", 
-                              command=partial(self.delete_image, img_path)).pack(pady=5)
-            except Exception as e:
-                ttk.Label(img_frame, text=f"无法加载图像\n{os.path.basename(img_path)}\n错误: {str(e)}",
-                         wraplength=200).pack(padx=10, pady=10)
+        # 已缓存的缩略图直接显示，其余先显示占位文字，由后台线程生成
+        for index in visible:
+            if index in self.grid_cells:
+                continue
+            cell = self.free_cells.pop() if self.free_cells else ThumbnailCell(canvas, self.delete_image)
+            self.grid_cells[index] = cell
+            row, col = divmod(index, GRID_COLUMNS)
+            img_path = group[index]
+            cell.show(img_path, col * cell_width, row * cell_height)
+            thumb = self.thumbnails.get(img_path)
+            if thumb is not None:
+                cell.set_thumbnail(thumb, self.thumbnails.file_size(img_path))
+            else:
+                self.thumbnails.request(img_path, partial(self.on_thumbnail_loaded, self.current_group_index))
         
-        # 更新画布滚动区域
-        display_frame.update_idletasks()
-        canvas.config(scrollregion=canvas.bbox("all"))
+        # 滚出视口的图像不再生成缩略图
+        self.thumbnails.cancel_pending(keep=[group[index] for index in visible] + self.prefetch_paths)
+    
+    def on_grid_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        self.update_visible_cells()
+    
+    def on_mouse_wheel(self, event):
+        if self.grid_canvas is None or not self.grid_canvas.winfo_exists():
+            return
+        step = -1 if event.num == 4 or event.delta > 0 else 1
+        self.grid_canvas.yview_scroll(step, "units")
+    
+    def prefetch_adjacent_groups(self, group_index):
+        """在后台预先生成前后两组开头的缩略图，翻页时即可直接显示"""
+        adjacent = []
+        for index in (group_index + 1, group_index - 1):
+            if 0 <= index < len(self.duplicate_groups):
+                adjacent.extend(self.duplicate_groups[index][:self.prefetch_limit])
+        self.prefetch_paths = adjacent
+        self.thumbnails.cancel_pending(keep=adjacent)
+        self.thumbnails.prefetch(adjacent)
+    
+    def on_thumbnail_loaded(self, group_index, img_path, result):
+        """缩略图生成完成（在工作线程中调用），经通道回到主线程更新单元格，同一张图在一个节拍内只显示一次"""
+        self.thumbnail_channel.post(self.show_thumbnail, group_index, img_path, result, key=(group_index, img_path))
+    
+    def show_thumbnail(self, group_index, img_path, result):
+        if group_index != self.current_group_index:
+            return  # 已经翻到其他组
+        for cell in self.grid_cells.values():
+            if cell.path == img_path:
+                if isinstance(result, Exception):
+                    cell.set_error(result)
+                else:
+                    cell.set_thumbnail(result, self.thumbnails.file_size(img_path))
     
     def show_previous_group(self):
         if self.duplicate_groups and self.current_group_index > 0:
@@ -470,6 +3050,8 @@ class ImageDuplicateFinder:
             # 确认删除
             if messagebox.askyesno("确认删除", f"确定要删除图像\n{img_path}?"):
                 os.remove(img_path)
+                self.thumbnails.discard(img_path)
+                self.forget_deleted([img_path])
                 self.status_text.set(f"已删除: {os.path.basename(img_path)}")
                 
                 # 从当前组中移除
@@ -488,12 +3070,322 @@ class ImageDuplicateFinder:
                     # 调整当前索引
                     if self.current_group_index >= len(self.duplicate_groups):
                         self.current_group_index = len(self.duplicate_groups) - 1
+                    self.show_group(self.current_group_index)
+                    return
                 
-                # 刷新显示
-                self.show_group(self.current_group_index)
+                # 刷新显示：复用现有单元格并保持滚动位置
+                self.layout_grid()
         except Exception as e:
             messagebox.showerror("删除错误", f"无法删除图像: {str(e)}")
 
+    def forget_deleted(self, paths):
+        """在后台线程中把删除的文件从相似度图中移除，调整阈值重新分组时不会再出现；
+        前一个后台线程（如上一次删除）结束后再更新，同一时间只有一个线程修改相似度图"""
+        engine = self.engine
+        if engine is None or engine.similarity_graph is None:
+            return
+        previous = self.scan_thread
+        self.scan_thread = threading.Thread(target=self.run_forget_deleted, args=(engine, paths, previous))
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+
+    def run_forget_deleted(self, engine, paths, previous):
+        if previous is not None and previous.is_alive():
+            previous.join()
+        engine.apply_changes(deleted=paths)
+
+    def start_reclaim(self):
+        """后台生成处理计划，确认试运行结果后再批量执行"""
+        if self.scan_thread is not None and self.scan_thread.is_alive():
+            return
+        if not self.duplicate_groups:
+            messagebox.showinfo("批量处理", "没有需要处理的重复图像")
+            return
+        
+        rule = next(key for key, name in KEEP_RULES.items() if name == self.keep_rule.get())
+        action = next(key for key, name in RECLAIM_ACTIONS.items() if name == self.reclaim_action.get())
+        groups = [list(group) for group in self.duplicate_groups]
+        self.progress_channel = ProgressChannel()
+        self.progress_channel.attach(self.root, self.show_scan_progress)
+        self.status_text.set("正在生成处理计划...")
+        self.scan_thread = threading.Thread(target=self.plan_reclaim, args=(groups, rule, action))
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+    
+    def plan_reclaim(self, groups, rule, action):
+        """在后台线程中选出每组保留的文件，并把试运行报告写入日志目录"""
+        channel = self.progress_channel
+        try:
+            items = list(plan_reclaim(groups, rule, action))
+            os.makedirs(RECLAIM_JOURNAL_DIR, exist_ok=True)
+            report_path = os.path.join(RECLAIM_JOURNAL_DIR, time.strftime("dry_run_%Y%m%d_%H%M%S.txt"))
+            with open(report_path, "w", encoding="utf-8") as report:
+                count, total_size = write_reclaim_report(items, report, action)
+            channel.post(self.confirm_reclaim, items, action, count, total_size, report_path)
+        except OSError as e:
+            channel.post(messagebox.showerror, "批量处理", f"无法生成处理计划: {e}")
+        finally:
+            channel.close()
+    
+    def confirm_reclaim(self, items, action, count, total_size, report_path):
+        if not items:
+            self.status_text.set("没有需要处理的文件")
+            return
+        message = (f"将{RECLAIM_ACTIONS[action]} {count} 个文件，预计释放 {format_size(total_size)}。\n"
+                   f"详细列表见:\n{report_path}\n\n确定执行吗?")
+        if not messagebox.askyesno("确认批量处理", message):
+            self.status_text.set("已取消批量处理")
+            return
+        
+        self.progress_channel = ProgressChannel()
+        self.progress_channel.attach(self.root, self.show_scan_progress)
+        self.scan_thread = threading.Thread(target=self.run_reclaim, args=(items, action))
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+    
+    def run_reclaim(self, items, action):
+        channel = self.progress_channel
+        reclaimer = SpaceReclaimer(action, progress_callback=lambda done, total, stage:
+                                   channel.update(done, total, stage, "个"))
+        engine = self.engine
+        try:
+            done_count, reclaimed, errors = reclaimer.run(items)
+            failed = {path for path, _ in errors}
+            processed = {item.path for item in items if item.path not in failed}
+            # 删除的文件也在后台线程中从相似度图中移除，调整阈值后不会再出现
+            if action == "delete" and engine is not None and engine.similarity_graph is not None:
+                channel.set_status("正在更新相似度图...")
+                engine.apply_changes(deleted=processed)
+            channel.post(self.finish_reclaim, processed, action, done_count, reclaimed, errors, reclaimer.journal_path)
+        except Exception as e:
+            # 单个文件的错误已记入日志；这里是日志无法写入、更新相似度图失败等整体错误
+            channel.post(self.status_text.set, "批量处理失败")
+            channel.post(messagebox.showerror, "批量处理",
+                         f"批量处理中断: {e}\n部分文件可能已处理，详见日志:\n{reclaimer.journal_path}\n请重新扫描")
+        finally:
+            channel.close()
+    
+    def finish_reclaim(self, processed, action, done_count, reclaimed, errors, journal_path):
+        """从显示的分组中移除已处理的文件"""
+        for path in processed:
+            self.thumbnails.discard(path)
+        self.duplicate_groups = [group for group in
+                                 ([path for path in group if path not in processed] for group in self.duplicate_groups)
+                                 if len(group) > 1]
+        
+        for widget in self.image_frame.winfo_children():
+            widget.destroy()
+        self.current_group_index = 0
+        self.progress.configure(value=100)
+        if self.duplicate_groups:
+            self.show_group(0)
+        summary = f"已{RECLAIM_ACTIONS[action]} {done_count} 个文件，释放 {format_size(reclaimed)}"
+        if errors:
+            summary += f"，{len(errors)} 个失败（见日志 {journal_path}）"
+        self.status_text.set(summary)
+
+def write_groups(groups, output, output_format="jsonl", start=1):
+    """逐组写出重复图像，每组写完立即flush，不在内存中保留全部结果；组号从start开始"""
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(output)
+        if start == 1:
+            writer.writerow(["group", "path", "size"])
+    
+    count = 0
+    for count, group in enumerate(groups, 1):
+        number = start + count - 1
+        files = []
+        for path in group:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+            files.append((path, size))
+        
+        if writer is not None:
+            writer.writerows((number, path, size) for path, size in files)
+        else:
+            record = {"group": number, "count": len(files),
+                      "files": [{"path": path, "size": size} for path, size in files]}
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+    return count
+
+
+def run_cli(args):
+    """命令行模式：不创建任何窗口，扫描后将重复组流式写入JSONL/CSV；--watch时继续监视并输出新的重复组
+    
+    文件夹不存在或输出文件无法创建时在扫描前报错并返回2
+    """
+    missing = [folder for folder in args.folders if not os.path.isdir(folder)]
+    if missing:
+        for folder in missing:
+            print(f"文件夹不存在: {folder}", file=sys.stderr)
+        return 2
+    
+    # 扫描前打开输出文件，避免长时间扫描后才发现路径无效
+    output_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    try:
+        output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    except OSError as e:
+        print(f"无法创建输出文件 {args.output}: {e}", file=sys.stderr)
+        return 2
+    try:
+        return scan_and_report(args, output, output_format)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def scan_and_report(args, output, output_format):
+    """执行扫描并把重复组逐组写入已打开的output，返回退出码"""
+    last_report = [0.0]
+    channel = ProgressChannel()
+    
+    def report_progress(done, total, stage):
+        channel.update(done, total, stage, "张" if stage == "扫描中" else "对")
+        now = time.time()
+        if done == total or now - last_report[0] >= 1:
+            last_report[0] = now
+            print(channel.snapshot().status, file=sys.stderr, flush=True)
+    
+    engine = DuplicateScanEngine(
+        method=args.method,
+        similarity_threshold=args.threshold,
+        worker_count=args.workers,
+        fast_decode=not args.exact_decode,
+        progress_callback=report_progress,
+        status_callback=lambda m: print(m, file=sys.stderr, flush=True)
+    )
+    engine.use_feature_cache = not args.no_cache
+    engine.use_checkpoints = not args.no_checkpoint
+    engine.feature_memmap_dir = args.memmap_dir
+    if args.ssim_exhaustive:
+        engine.ssim_prefilter_margin = None
+    elif args.ssim_prefilter is not None:
+        engine.ssim_prefilter_margin = args.ssim_prefilter
+    
+    # 扫描期间Ctrl+C和SIGTERM都只请求取消：保存比较检查点、关闭工作进程，再以130退出
+    handle_signals = threading.current_thread() is threading.main_thread()
+    if handle_signals:
+        previous_sigint = signal.signal(signal.SIGINT, lambda signum, frame: engine.cancel())
+        previous_sigterm = signal.signal(signal.SIGTERM, lambda signum, frame: engine.cancel())
+    
+    # 在首次扫描前开始监视，扫描期间发生的变化也会在之后补上；
+    # 无论正常结束、取消还是出错，最后都关闭监视器和特征库（内存映射文件及其临时文件）
+    watcher = None
+    try:
+        if args.watch:
+            watcher = FolderWatcher(args.folders, poll_interval=args.poll_interval, use_inotify=not args.poll)
+            watcher.start()
+        try:
+            engine.run(args.folders)
+        except (ScanCancelled, KeyboardInterrupt):
+            print("扫描已取消，已提取的特征和比较进度已保存，使用相同参数重新运行将从中断处继续", file=sys.stderr)
+            return 130
+        finally:
+            if handle_signals:
+                # 监视阶段恢复原来的处理方式，Ctrl+C和SIGTERM直接退出
+                signal.signal(signal.SIGINT, previous_sigint)
+                signal.signal(signal.SIGTERM, previous_sigterm)
+        
+        count = write_groups(engine.iter_groups(), output, output_format)
+        print(f"扫描完成：共 {engine.image_count} 张图片，找到 {count} 组重复图像", file=sys.stderr)
+        if args.reclaim:
+            reclaim_groups(engine, args)
+        
+        if watcher is not None:
+            print(f"正在监视文件夹变化（{watcher.mode}），按Ctrl+C退出...", file=sys.stderr, flush=True)
+            group_count = [count]
+            
+            def on_change(changed, deleted, moved):
+                groups = engine.apply_changes(changed, deleted, moved)
+                group_count[0] += write_groups(groups, output, output_format, start=group_count[0] + 1)
+                print(f"新增或修改 {len(changed)}，删除 {len(deleted)}，移动 {len(moved)}，"
+                      f"新的重复组 {len(groups)}", file=sys.stderr, flush=True)
+            
+            try:
+                watcher.run(on_change)
+            except (KeyboardInterrupt, ScanCancelled):
+                # 扫描刚结束时收到的取消请求会在下一次应用变化时抛出ScanCancelled，同样视为退出
+                pass
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if engine.features is not None:
+            engine.features.close()
+    return 0
+
+
+def reclaim_groups(engine, args):
+    """命令行批量处理：--dry-run时只输出报告，否则执行并把每个操作记入日志"""
+    items = list(plan_reclaim(engine.iter_groups(), args.keep, args.reclaim))
+    if args.dry_run:
+        write_reclaim_report(items, sys.stderr, args.reclaim)
+        return
+    
+    last_report = [0.0]
+    
+    def report_progress(done, total, stage):
+        now = time.time()
+        if done == total or now - last_report[0] >= 1:
+            last_report[0] = now
+            print(f"{stage}... {done}/{total}", file=sys.stderr, flush=True)
+    
+    reclaimer = SpaceReclaimer(args.reclaim, args.journal, report_progress)
+    done_count, reclaimed, errors = reclaimer.run(items)
+    if args.reclaim == "delete" and engine.similarity_graph is not None:
+        failed = {path for path, _ in errors}
+        engine.apply_changes(deleted=[item.path for item in items if item.path not in failed])
+    for path, error in errors:
+        print(f"无法处理文件 {path}: {error}", file=sys.stderr)
+    print(f"已{RECLAIM_ACTIONS[args.reclaim]} {done_count} 个文件，释放 {format_size(reclaimed)}，"
+          f"日志: {reclaimer.journal_path}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查找重复或相似的图片；不提供文件夹时启动图形界面")
+    parser.add_argument("folders", nargs="*", help="要扫描的文件夹，提供时以命令行模式运行")
+    parser.add_argument("--method", "-m", choices=["phash", "histogram", "ssim"], default="phash",
+                        help="比较算法（默认phash）")
+    parser.add_argument("--threshold", "-t", type=int, default=90, help="相似度阈值1-100（默认90）")
+    parser.add_argument("--output", "-o", default="-", help="输出文件路径，默认输出到标准输出")
+    parser.add_argument("--format", "-f", choices=["jsonl", "csv"], help="输出格式，默认按扩展名判断")
+    parser.add_argument("--workers", "-w", type=int, help="特征提取的并行进程数（默认CPU核数）")
+    parser.add_argument("--exact-decode", action="store_true", help="按原图精确解码，不使用JPEG缩放解码")
+    parser.add_argument("--no-cache", action="store_true", help="不读写磁盘特征缓存")
+    parser.add_argument("--no-checkpoint", action="store_true", help="比较阶段不保存检查点")
+    parser.add_argument("--memmap-dir", help="将特征数组映射到该目录下的临时文件，图库很大时减少内存占用")
+    ssim_group = parser.add_mutually_exclusive_group()
+    ssim_group.add_argument("--ssim-prefilter", type=float, metavar="MARGIN",
+                            help=f"SSIM缩略图预筛选允许低于阈值的余量（默认{SSIM_PREFILTER_MARGIN}），越大召回越高、越慢")
+    ssim_group.add_argument("--ssim-exhaustive", action="store_true",
+                            help="SSIM不做预筛选，精确比较所有图像对（图像多时很慢）")
+    parser.add_argument("--reclaim", choices=list(RECLAIM_ACTIONS),
+                        help="扫描后按--keep规则保留每组一个文件，其余删除或替换为硬链接/reflink")
+    parser.add_argument("--keep", choices=list(KEEP_RULES), default="resolution",
+                        help="每组保留的文件：resolution分辨率最高、oldest修改时间最早、shortest路径最短（默认resolution）")
+    parser.add_argument("--dry-run", action="store_true", help="只输出批量处理计划，不修改任何文件")
+    parser.add_argument("--journal", help="批量处理日志路径（JSONL），默认写入缓存目录")
+    parser.add_argument("--watch", action="store_true", help="扫描后继续监视文件夹，增量输出新的重复组")
+    parser.add_argument("--poll", action="store_true", help="监视时不使用inotify，改为定期轮询（如网络文件系统）")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="轮询间隔秒数（默认5）")
+    args = parser.parse_args(argv)
+    
+    if args.folders:
+        return run_cli(args)
+    
+    if tk is None:
+        print("未安装tkinter，只能使用命令行模式，请提供要扫描的文件夹")
+        return 1
+    root = tk.Tk()
+    app = ImageDuplicateFinder(root)
+    root.mainloop()
+    app.thumbnails.close()
+    return 0
+
+
 if __name__ == "__main__":
     try:
         # 检查必要的库
@@ -506,9 +3398,6 @@ if __name__ == "__main__":
         print(f"缺少必要的库: {e}")
         print("请安装以下库:")
         print("pip install pillow imagehash opencv-python numpy scikit-image")
-        import sys
         sys.exit(1)
-        
-    root = tk.Tk()
-    app = ImageDuplicateFinder(root)
-    root.mainloop() 
\ No newline at end of file
+    
+    sys.exit(main()) 
\ No newline at end of file
@@ -1,11 +1,190 @@
 import os
+import re
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import threading
+import time
+import random
+import hashlib
+import sqlite3
 import json
 import requests
-from PIL import Image, ImageTk
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image, ImageOps, ImageTk
 import io
+from progress_channel import ProgressChannel, format_duration
+
+# 可以重试的HTTP状态码：限流和服务端临时错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 上传前重新编码的格式及其MIME类型
+UPLOAD_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+# 分类结果缓存
+RESULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".photo_classifier", "results.sqlite")
+# 批量分类回答中的一行，必须以“图片序号”开头，例如“图片3: 7. 圣诞节”，允许Markdown加粗和全角冒号
+BATCH_ANSWER_PATTERN = re.compile(r"^[\s*#>-]*图片\s*(\d+)[\s*]*[:：]\s*(.+)$")
+# 回答中独立出现的数字（不是更长数字的一部分），用于精确匹配主题编号
+THEME_NUMBER_PATTERN = re.compile(r"(?<!\d)(\d+)(?!\d)")
+
+def to_8bit(img):
+    """16位灰度（I;16等）按比例缩到8位灰度；直接convert("RGB")会把大于255的值截断成白色"""
+    return img.convert("I").point(lambda value: value / 256).convert("L")
+
+def encode_for_upload(image_path, max_edge=1024, image_format="JPEG", quality=85):
+    """把图片缩小到最长边不超过max_edge并重新编码，返回(字节串, MIME类型)
+    
+    JPEG先用草稿模式按接近目标的尺寸解码；按EXIF方向旋转，16位图像缩到8位，CMYK转为RGB，透明部分铺白底。
+    原图已经是目标格式、RGB或灰度且足够小时直接使用原文件
+    """
+    with Image.open(image_path) as img:
+        if img.format == image_format and img.mode in ("RGB", "L") and max(img.size) <= max_edge \
+                and "exif" not in img.info:
+            with open(image_path, 'rb') as image_file:
+                return image_file.read(), UPLOAD_MIME_TYPES[image_format]
+        
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        if img.mode.startswith("I;16") or (img.mode == "I" and img.getextrema()[1] > 255):
+            img = to_8bit(img)
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue(), UPLOAD_MIME_TYPES[image_format]
+
+class ClassificationError(Exception):
+    """分类请求最终失败（重试用尽或不可重试的错误），该图片不计入任何分类"""
+
+def retry_after_seconds(response):
+    """解析Retry-After响应头（秒数或HTTP日期），没有或无法解析时返回None"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class ResultCache:
+    """持久化的分类结果缓存，以(图片内容哈希, 模型, 提示词哈希)为键
+    
+    同一张图片移动或改名后仍能命中；主题列表或模型变化后自动不再命中旧结果。
+    文件的内容哈希另按(路径, 大小, 修改时间)缓存，未变化的文件无需重新读取。可被多个线程共用
+    """
+    
+    def __init__(self, db_path=RESULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "content_hash TEXT NOT NULL, model TEXT NOT NULL, prompt_hash TEXT NOT NULL, "
+                "theme TEXT NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (content_hash, model, prompt_hash))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, content_hash TEXT NOT NULL)"
+            )
+            self.conn.commit()
+    
+    def content_hash(self, image_path):
+        """返回文件内容的BLAKE2摘要；文件大小和修改时间未变时直接使用上次的结果"""
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content_hash FROM file_hashes WHERE path=? AND size=? AND mtime_ns=?",
+                (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row:
+            return row[0]
+        
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as image_file:
+            for chunk in iter(lambda: image_file.read(1 << 20), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, content_hash)
+            )
+            self.conn.commit()
+        return content_hash
+    
+    def get(self, content_hash, model, prompt_hash):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT theme FROM results WHERE content_hash=? AND model=? AND prompt_hash=?",
+                (content_hash, model, prompt_hash)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def put(self, content_hash, model, prompt_hash, theme):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (content_hash, model, prompt_hash, theme, created) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, model, prompt_hash, theme, time.time())
+            )
+            self.conn.commit()
+    
+    def clear(self, keep_prompt_hash=None):
+        """删除缓存的分类结果；指定keep_prompt_hash时只删除其他提示词（旧主题列表）的结果"""
+        with self.lock:
+            if keep_prompt_hash is None:
+                self.conn.execute("DELETE FROM results")
+            else:
+                self.conn.execute("DELETE FROM results WHERE prompt_hash != ?", (keep_prompt_hash,))
+            self.conn.commit()
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class RateLimiter:
+    """线程安全的令牌桶：平均每秒最多rate次请求，空闲后最多允许burst次连续突发；rate<=0表示不限速
+    
+    burst为1时请求间隔至少1/rate秒，任意一秒内不超过rate次；burst更大时一秒内最多可放行约rate+burst次
+    
+    开始时只有一个令牌，刚启动时的请求也按速率均匀发出，不会一开始就用满突发额度
+    """
+    
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = 1
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """取得一个令牌，令牌不足时等待"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
 
 class PhotoClassifierApp:
     def __init__(self, root):
@@ -51,6 +230,21 @@ class PhotoClassifierApp:
         self.api_key = ""  # 豆包模型API Bearer Token
         self.api_url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"  # 豆包API URL
         self.model = "doubao-1.5-vision-pro-32k-250115"  # 豆包视觉模型
+        self.max_in_flight = 8  # 同时进行中的最多请求数
+        self.requests_per_second = 5.0  # 每秒最多发出的请求数，0表示不限速
+        self.batch_size = 1  # 每个请求分类的图片数，大于1时主题列表在一批图片间共用
+        self.connect_timeout = 10  # 建立连接的超时秒数
+        self.read_timeout = 120  # 等待模型回复的超时秒数
+        self.max_retries = 5  # 限流、服务端错误和网络错误的最多重试次数
+        self.backoff_base = 1.0  # 指数退避的初始等待秒数
+        self.backoff_max = 60.0  # 指数退避单次等待的最长秒数
+        self.retry_after_max = 300.0  # 服务端要求等待（Retry-After）超过该秒数时不再重试，直接返回错误
+        self.session = None  # 所有请求共用的连接池，保持长连接
+        self.upload_max_edge = 1024  # 上传前把图片缩小到的最长边像素
+        self.upload_format = "JPEG"  # 上传的编码格式: "JPEG" 或 "WEBP"
+        self.upload_quality = 85  # 重新编码的质量
+        self.rate_limiter = None  # 分类过程中所有请求共用的限速器
+        self.result_cache = None  # 分类结果缓存，不使用缓存时为None
         
         # 创建GUI组件
         self.create_widgets()
@@ -61,6 +255,8 @@ class PhotoClassifierApp:
         self.processing = False
         self.current_image_index = 0
         self.classified_images = {}  # 分类结果: {theme_name: [image_paths]}
+        self.failed_images = {}  # 最终失败的图片: {image_path: 错误信息}，可重新分类
+        self.progress_channel = None  # 后台线程写入、界面定时读取的进度通道
     
     def create_widgets(self):
         # 创建顶部框架
@@ -101,6 +297,28 @@ class PhotoClassifierApp:
         )
         model_dropdown.pack(side=tk.LEFT, padx=5)
         
+        # 并发请求设置
+        concurrency_frame = tk.Frame(self.root)
+        concurrency_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        tk.Label(concurrency_frame, text="并发请求数:").pack(side=tk.LEFT, padx=5)
+        self.max_in_flight_var = tk.IntVar(value=self.max_in_flight)
+        tk.Spinbox(concurrency_frame, from_=1, to=64, textvariable=self.max_in_flight_var, width=5).pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(concurrency_frame, text="每秒最多请求数(0为不限):").pack(side=tk.LEFT, padx=5)
+        self.requests_per_second_var = tk.DoubleVar(value=self.requests_per_second)
+        tk.Spinbox(concurrency_frame, from_=0, to=100, increment=0.5, textvariable=self.requests_per_second_var,
+                   width=6).pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(concurrency_frame, text="每次请求图片数:").pack(side=tk.LEFT, padx=5)
+        self.batch_size_var = tk.IntVar(value=self.batch_size)
+        tk.Spinbox(concurrency_frame, from_=1, to=10, textvariable=self.batch_size_var, width=4).pack(side=tk.LEFT, padx=5)
+        
+        # 结果缓存：同一张图片在相同模型和主题列表下不再重复请求
+        self.use_result_cache_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(concurrency_frame, text="使用结果缓存", variable=self.use_result_cache_var).pack(side=tk.LEFT, padx=5)
+        tk.Button(concurrency_frame, text="清除结果缓存", command=self.clear_result_cache).pack(side=tk.LEFT, padx=5)
+        
         # 创建中间的图片预览区域
         preview_frame = tk.Frame(self.root)
         preview_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -122,6 +340,10 @@ class PhotoClassifierApp:
         self.progress_text.set("0/0")
         tk.Label(progress_frame, textvariable=self.progress_text, width=10).pack(side=tk.LEFT, padx=5)
         
+        # 处理速度和预计剩余时间
+        self.speed_text = tk.StringVar()
+        tk.Label(progress_frame, textvariable=self.speed_text, width=22, anchor=tk.W).pack(side=tk.LEFT, padx=5)
+        
         # 结果显示区域
         results_frame = tk.Frame(self.root)
         results_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -196,11 +418,31 @@ class PhotoClassifierApp:
             messagebox.showwarning("警告", "请选择模型")
             return
         
+        # 获取并发设置
+        try:
+            self.max_in_flight = max(1, int(self.max_in_flight_var.get()))
+            self.requests_per_second = max(0.0, float(self.requests_per_second_var.get()))
+            self.batch_size = max(1, int(self.batch_size_var.get()))
+        except (tk.TclError, ValueError):
+            messagebox.showwarning("警告", "请输入有效的并发请求数、每秒请求数和每次请求图片数")
+            return
+        
         # 重置分类结果
         self.classified_images = {theme: [] for theme in self.themes}
+        self.failed_images = {}
+        self.session = self.create_session()
+        if self.use_result_cache_var.get():
+            if self.result_cache is None:
+                self.result_cache = ResultCache()
+            # 主题列表改动后旧提示词的结果不会再命中，开始分类时顺便清掉
+            self.result_cache.clear(keep_prompt_hash=self.prompt_hash())
+        elif self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
         self.current_image_index = 0
         self.progress_var.set(0)
         self.progress_text.set(f"0/{len(self.image_files)}")
+        self.speed_text.set("")
         self.results_listbox.delete(0, tk.END)
         
         # 禁用按钮
@@ -208,60 +450,228 @@ class PhotoClassifierApp:
         self.folder_btn.config(state=tk.DISABLED)
         self.processing = True
         
-        # 在后台线程中处理，避免GUI卡顿
+        # 在后台线程中处理，避免GUI卡顿；后台线程只写入进度通道，界面每100毫秒合并刷新一次
+        self.progress_channel = ProgressChannel()
+        self.progress_channel.attach(self.root, self.update_progress)
         threading.Thread(target=self.process_images, daemon=True).start()
     
     def process_images(self):
-        """处理所有图片（在后台线程中运行）"""
+        """并发处理所有图片（在后台线程中运行）
+        
+        最多同时进行max_in_flight个请求，并按requests_per_second限速；batch_size大于1时每个任务是一批图片。
+        结果按完成顺序在本线程中记录，再投递到界面线程
+        """
         total_images = len(self.image_files)
+        channel = self.progress_channel
+        channel.update(0, total_images, "分类中", "张")
+        self.rate_limiter = self.create_rate_limiter()
+        batches = (self.image_files[start:start + self.batch_size]
+                   for start in range(0, total_images, self.batch_size))
+        pending = {}  # Future -> 这一批的图片路径
+        done_count = 0
         
-        for i, image_path in enumerate(self.image_files):
+        def classify(image_paths):
             if not self.processing:
-                break
+                return [None] * len(image_paths)
+            if len(image_paths) == 1:
+                try:
+                    return [self.classify_image(image_paths[0])]
+                except ClassificationError as e:
+                    return [e]
+            return self.classify_batch(image_paths)
+        
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="classify") as executor:
+            while True:
+                # 补足在途请求；停止处理后不再提交新请求，只等待已发出的请求完成
+                while self.processing and len(pending) < self.max_in_flight:
+                    image_paths = next(batches, None)
+                    if image_paths is None:
+                        break
+                    pending[executor.submit(classify, image_paths)] = image_paths
+                if not pending:
+                    break
                 
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    image_paths = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        channel.post(messagebox.showerror, "错误", f"处理图片时出错: {str(e)}")
+                        done_count += len(image_paths)
+                        channel.update(done_count, total_images, "分类中", "张")
+                        continue
+                    
+                    for image_path, theme in zip(image_paths, results):
+                        if theme is None:
+                            continue  # 已停止处理，未发出请求
+                        if isinstance(theme, ClassificationError):
+                            # 最终失败的图片单独记录，不混入分类结果
+                            self.failed_images[image_path] = str(theme)
+                            channel.post(self.update_results, image_path, f"失败: {theme}")
+                        else:
+                            # 记录分类结果
+                            if theme in self.classified_images:
+                                self.classified_images[theme].append(image_path)
+                            else:
+                                # 如果返回的主题不在预定义列表中，归类为"未分类"
+                                if "未分类" not in self.classified_images:
+                                    self.classified_images["未分类"] = []
+                                self.classified_images["未分类"].append(image_path)
+                        
+                            # 更新预览和结果列表（在主线程中），预览只显示每个节拍内的最后一张
+                            channel.post(self.update_preview, image_path, key="preview")
+                            channel.post(self.update_results, image_path, theme)
+                        
+                        done_count += 1
+                    channel.update(done_count, total_images, "分类中", "张")
+        
+        # 完成处理
+        channel.post(self.finish_processing)
+        channel.close()
+    
+    def theme_prompt(self):
+        """分类指令和主题列表"""
+        return "这张图片属于下面哪个主题分类？请只回答分类编号及名称，不要解释原因。\n" + "\n".join(self.themes)
+    
+    def prompt_hash(self):
+        return hashlib.blake2b(self.theme_prompt().encode("utf-8"), digest_size=16).hexdigest()
+    
+    def batch_prompt(self, image_count):
+        """一次请求分类多张图片时的指令，要求按图片序号逐行回答"""
+        return (f"下面依次给出{image_count}张图片，请分别判断每张图片属于下面哪个主题分类。"
+                f"请逐行回答，每行格式为“图片N: 分类编号及名称”（N为图片序号），图片1到图片{image_count}各一行，不要解释原因。\n"
+                + "\n".join(self.themes))
+    
+    def cached_theme(self, image_path):
+        """返回(内容哈希, 缓存的分类结果)；不使用缓存时为(None, None)，未命中时结果为None"""
+        cache = self.result_cache
+        if cache is None:
+            return None, None
+        try:
+            content_hash = cache.content_hash(image_path)
+        except OSError as e:
+            raise ClassificationError(f"处理错误: {str(e)}")
+        return content_hash, cache.get(content_hash, self.model, self.prompt_hash())
+    
+    def store_theme(self, content_hash, theme):
+        """写入结果缓存；“未分类”是回答无法匹配主题时的兜底结果，不缓存，下次重新请求"""
+        if theme == "未分类":
+            return
+        if self.result_cache is not None and content_hash is not None:
+            self.result_cache.put(content_hash, self.model, self.prompt_hash(), theme)
+    
+    def classify_image(self, image_path):
+        """对图片进行分类：先按图片内容查结果缓存，未命中时再调用豆包API，成功的结果写入缓存"""
+        content_hash, theme = self.cached_theme(image_path)
+        if theme is None:
+            theme = self.request_classification(image_path)
+            self.store_theme(content_hash, theme)
+        return theme
+    
+    def classify_batch(self, image_paths):
+        """用一个请求分类多张图片，返回与image_paths一一对应的结果（主题或ClassificationError）
+        
+        缓存命中的图片不再发送，无法读取的图片单独记为失败；
+        批量请求失败或回答中缺少、无法识别某张图片时，这些图片改为逐张请求
+        """
+        results = [None] * len(image_paths)
+        pending = []  # (位置, 图片路径, 内容哈希, 编码好的图片消息)
+        for index, image_path in enumerate(image_paths):
             try:
-                # 更新UI（在主线程中）
-                self.root.after(0, self.update_progress, i, total_images)
-                self.root.after(0, self.update_preview, image_path)
-                
-                # 调用豆包API进行分类
-                theme = self.classify_image(image_path)
-                
-                # 记录分类结果
-                if theme in self.classified_images:
-                    self.classified_images[theme].append(image_path)
+                content_hash, theme = self.cached_theme(image_path)
+                if theme is None:
+                    pending.append((index, image_path, content_hash, self.image_content(image_path)))
                 else:
-                    # 如果返回的主题不在预定义列表中，归类为"未分类"
-                    if "未分类" not in self.classified_images:
-                        self.classified_images["未分类"] = []
-                    self.classified_images["未分类"].append(image_path)
-                
-                # 更新结果列表（在主线程中）
-                self.root.after(0, self.update_results, image_path, theme)
-                
+                    results[index] = theme
+            except ClassificationError as e:
+                results[index] = e
             except Exception as e:
-                self.root.after(0, messagebox.showerror, "错误", f"处理图片时出错: {str(e)}")
+                results[index] = ClassificationError(f"处理错误: {str(e)}")
         
-        # 完成处理
-        self.root.after(0, self.finish_processing)
+        if len(pending) > 1:
+            try:
+                answers = self.request_batch_classification([prepared for *_, prepared in pending])
+            except ClassificationError as e:
+                print(f"批量分类失败，改为逐张分类: {e}")
+                answers = {}
+            remaining = []
+            for number, item in enumerate(pending, 1):
+                index, _, content_hash, _ = item
+                theme = answers.get(number)
+                if theme is None:
+                    remaining.append(item)
+                else:
+                    results[index] = theme
+                    self.store_theme(content_hash, theme)
+            pending = remaining
+        
+        for index, image_path, content_hash, prepared in pending:
+            if not self.processing:
+                break
+            try:
+                results[index] = self.request_classification(image_path, prepared)
+                self.store_theme(content_hash, results[index])
+            except ClassificationError as e:
+                results[index] = e
+        return results
     
-    def classify_image(self, image_path):
-        """调用豆包API对图片进行分类"""
+    def request_batch_classification(self, image_contents):
+        """调用豆包API一次分类多张图片，返回 {图片序号(从1开始): 主题}，只包含能明确对应的回答"""
         try:
-            # 读取图片文件
-            with open(image_path, 'rb') as image_file:
-                image_data = image_file.read()
+            content = [{"type": "text", "text": self.batch_prompt(len(image_contents))}]
+            for number, image_content in enumerate(image_contents, 1):
+                content.append({"type": "text", "text": f"图片{number}:"})
+                content.append(image_content)
             
+            headers = {
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {self.api_key}'
+            }
+            payload = {
+                "model": self.model,
+                "messages": [{"role": "user", "content": content}]
+            }
+            response = self.post_with_retry(headers, payload)
+            if response.status_code != 200:
+                raise self.api_error(response)
+            reply = response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
+        except ClassificationError:
+            raise
+        except Exception as e:
+            raise ClassificationError(f"处理错误: {str(e)}")
+        
+        print(f"API批量返回结果: {reply}")  # 调试信息
+        return self.parse_batch_answer(reply, len(image_contents))
+    
+    def parse_batch_answer(self, reply, image_count):
+        """把“图片N: 主题”格式的逐行回答对应回图片序号
+        
+        回答必须恰好包含图片1到图片N各一行，否则视为格式错误返回空字典，整批改为逐张请求；
+        格式正确但某一行匹配不到主题时，只有这张图片改为单独请求
+        """
+        numbers = []
+        themes = {}
+        for line in reply.splitlines():
+            match = BATCH_ANSWER_PATTERN.match(line.strip())
+            if match:
+                number = int(match.group(1))
+                numbers.append(number)
+                themes[number] = self.match_theme(match.group(2))
+        if sorted(numbers) != list(range(1, image_count + 1)):
+            print(f"批量回答格式不符，应为图片1到图片{image_count}各一行")
+            return {}
+        return {number: theme for number, theme in themes.items() if theme != "未分类"}
+    
+    def request_classification(self, image_path, prepared=None):
+        """调用豆包API对图片进行分类；prepared为已经编码好的图片消息（如批量请求失败后重试），None时现场编码"""
+        try:
             # 准备API请求
             headers = {
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {self.api_key}'
             }
             
-            # 使用base64编码图片
-            import base64
-            encoded_image = base64.b64encode(image_data).decode('utf-8')
-            
             # 根据火山引擎文档构建正确的请求体
             payload = {
                 "model": self.model,  # 使用用户选择的模型
@@ -271,21 +681,16 @@ class PhotoClassifierApp:
                         "content": [
                             {
                                 "type": "text",
-                                "text": "这张图片属于下面哪个主题分类？请只回答分类编号及名称，不要解释原因。\n" + "\n".join(self.themes)
+                                "text": self.theme_prompt()
                             },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{encoded_image}"
-                                }
-                            }
+                            prepared or self.image_content(image_path)
                         ]
                     }
                 ]
             }
             
-            # 发送API请求
-            response = requests.post(self.api_url, headers=headers, json=payload)
+            # 发送API请求（共用连接池，限流和临时错误自动重试）
+            response = self.post_with_retry(headers, payload)
             
             if response.status_code == 200:
                 result = response.json()
@@ -294,42 +699,123 @@ class PhotoClassifierApp:
                 
                 print(f"API返回结果: {content}")  # 调试信息
                 
-                # 解析回复内容，寻找主题编号
-                for theme in self.themes:
-                    theme_number = theme.split('.')[0].strip()
-                    theme_name = theme.split('. ')[1].split(' ')[0] if '. ' in theme else ""
-                    
-                    # 检查主题编号或主题名称是否在内容中
-                    if theme_number in content or (theme_name and theme_name in content):
-                        return theme
-                
-                # 如果没有找到匹配的主题，返回一个默认主题
-                return "未分类"
+                return self.match_theme(content)
             else:
-                # API请求失败，解析错误信息
-                error_info = "未知错误"
-                try:
-                    error_json = response.json()
-                    error_type = error_json.get("type", "")
-                    error_code = error_json.get("code", "")
-                    error_message = error_json.get("message", "")
-                    error_info = f"{error_type}.{error_code}: {error_message}"
-                except:
-                    error_info = f"HTTP错误: {response.status_code}, {response.text}"
-                
-                print(f"API请求失败: {error_info}")  # 调试信息
-                
-                return f"API错误: {error_info}"
+                raise self.api_error(response)
                 
+        except ClassificationError:
+            raise
         except Exception as e:
             print(f"分类图片时出错: {str(e)}")
-            return f"处理错误: {str(e)}"
+            raise ClassificationError(f"处理错误: {str(e)}")
+    
+    def image_content(self, image_path):
+        """请求消息中的一张图片：缩小并重新编码后以base64内联，请求体和图像token都随之减少"""
+        import base64
+        image_data, mime_type = encode_for_upload(image_path, self.upload_max_edge, self.upload_format,
+                                                  self.upload_quality)
+        encoded_image = base64.b64encode(image_data).decode('utf-8')
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{encoded_image}"
+            }
+        }
+    
+    def match_theme(self, content):
+        """在回答中寻找主题编号或名称，找不到时返回“未分类”
+        
+        编号按完整数字精确匹配（“17”不会匹配主题1）；回答中没有有效编号时再按主题名称查找
+        """
+        themes_by_number = {theme.split('.')[0].strip(): theme for theme in self.themes}
+        for number in THEME_NUMBER_PATTERN.findall(content):
+            if number.lstrip('0') in themes_by_number:
+                return themes_by_number[number.lstrip('0')]
+        
+        for theme in self.themes:
+            theme_name = theme.split('. ')[1].split(' ')[0] if '. ' in theme else ""
+            
+            # 检查主题名称是否在内容中
+            if theme_name and theme_name in content:
+                return theme
+        
+        # 如果没有找到匹配的主题，返回一个默认主题
+        return "未分类"
+    
+    def api_error(self, response):
+        """把失败的API响应转换为ClassificationError"""
+        error_info = "未知错误"
+        try:
+            error_json = response.json()
+            error_type = error_json.get("type", "")
+            error_code = error_json.get("code", "")
+            error_message = error_json.get("message", "")
+            error_info = f"{error_type}.{error_code}: {error_message}"
+        except:
+            error_info = f"HTTP错误: {response.status_code}, {response.text}"
+        
+        print(f"API请求失败: {error_info}")  # 调试信息
+        
+        return ClassificationError(f"API错误: {error_info}")
+    
+    def create_session(self):
+        """创建共用的HTTP会话：连接池大小与并发请求数一致，连接在请求之间保持"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    
+    def create_rate_limiter(self):
+        """不允许突发：请求按1/每秒请求数的间隔均匀发出，任意一秒内都不会超过每秒请求数"""
+        return RateLimiter(self.requests_per_second)
+    
+    def post_with_retry(self, headers, payload):
+        """发送请求；429/5xx和网络错误按带抖动的指数退避重试，服务端给出Retry-After时至少等待该时长
+        
+        返回最后一次的响应；Retry-After超过retry_after_max时不提前重试，直接返回该响应；
+        重试用尽仍为网络错误时抛出ClassificationError
+        """
+        session = self.session or requests
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()  # 重试同样计入限速
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            try:
+                response = session.post(self.api_url, headers=headers, json=payload,
+                                        timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries or not self.processing:
+                    raise ClassificationError(f"网络错误: {e}")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries \
+                        or not self.processing:
+                    return response
+                retry_after = retry_after_seconds(response)
+                if retry_after is not None:
+                    if retry_after > self.retry_after_max:
+                        return response
+                    delay = max(delay, retry_after)
+                print(f"请求失败（HTTP {response.status_code}），{delay:.1f}秒后重试")  # 调试信息
+            time.sleep(delay)
+    
+    def clear_result_cache(self):
+        """清除缓存的分类结果，例如修改了主题说明但希望旧结果立即失效"""
+        if not messagebox.askyesno("清除结果缓存", "确定要清除所有缓存的分类结果吗？"):
+            return
+        cache = self.result_cache or ResultCache()
+        cache.clear()
+        if cache is not self.result_cache:
+            cache.close()
+        messagebox.showinfo("提示", "结果缓存已清除")
     
-    def update_progress(self, current, total):
-        """更新进度条"""
-        progress = (current + 1) / total * 100
-        self.progress_var.set(progress)
-        self.progress_text.set(f"{current + 1}/{total}")
+    def update_progress(self, snapshot):
+        """更新进度条、处理速度和预计剩余时间"""
+        if snapshot.total:
+            self.progress_var.set(snapshot.done / snapshot.total * 100)
+        self.progress_text.set(f"{snapshot.done}/{snapshot.total}")
+        if snapshot.rate:
+            self.speed_text.set(f"{snapshot.rate * 60:.1f} 张/分钟，剩余 {format_duration(snapshot.eta)}")
     
     def update_preview(self, image_path):
         """更新图片预览"""
@@ -369,6 +855,8 @@ class PhotoClassifierApp:
             count = len(self.classified_images.get(theme, []))
             if count > 0:
                 self.results_listbox.insert(tk.END, f"{theme}: {count}张图片")
+        if self.failed_images:
+            self.results_listbox.insert(tk.END, f"失败: {len(self.failed_images)}张图片（未计入分类）")
         
         messagebox.showinfo("处理完成", f"已完成 {len(self.image_files)} 张图片的分类")
     
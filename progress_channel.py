@@ -0,0 +1,131 @@
+import time
+from collections import deque, namedtuple
+
+
+# 界面每次轮询得到的进度快照；rate为每秒完成数，eta为剩余秒数，无法估计时为None
+ProgressSnapshot = namedtuple("ProgressSnapshot", "stage done total unit rate eta status")
+
+
+def format_duration(seconds):
+    """把秒数格式化为 时:分:秒 或 分:秒"""
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def format_progress(snapshot):
+    """生成进度文字，例如：扫描中... 1200/5000 (350 张/秒，剩余 0:11)"""
+    text = f"{snapshot.stage}... {snapshot.done}/{snapshot.total}"
+    details = []
+    if snapshot.rate:
+        details.append(f"{snapshot.rate:.0f} {snapshot.unit}/秒" if snapshot.rate >= 10 else
+                       f"{snapshot.rate:.1f} {snapshot.unit}/秒")
+    if snapshot.eta is not None:
+        details.append(f"剩余 {format_duration(snapshot.eta)}")
+    if details:
+        text += f" ({'，'.join(details)})"
+    return text
+
+
+class ProgressChannel:
+    """工作线程与界面之间的进度通道
+
+    工作线程调用update/set_status/post，只覆盖最新值或追加到双端队列，不加锁也不触碰Tk；
+    界面线程用attach按固定节拍（默认10次/秒）轮询，合并期间的所有更新后只刷新一次界面，
+    并根据最近几秒的完成数计算速率和剩余时间
+    """
+
+    def __init__(self, rate_window=5.0):
+        self.rate_window = rate_window  # 计算速率时参考最近多少秒的进度
+        self._progress = None  # (阶段, 已完成, 总数, 单位, 时间)，整体替换，读写都是原子操作
+        self._status = None  # (状态文字, 时间)
+        self._calls = deque()  # 需要逐个在界面线程执行的回调
+        self._latest_calls = {}  # 键 -> 回调，同一个键只执行最后一次
+        self._samples = deque()  # 界面线程记录的(时间, 已完成数)
+        self._sample_stage = None
+        self._closed = False
+        self._job = None
+
+    # 以下三个方法由工作线程调用
+    def update(self, done, total, stage="", unit="个"):
+        self._progress = (stage, done, total, unit, time.monotonic())
+
+    def set_status(self, text):
+        self._status = (text, time.monotonic())
+
+    def post(self, func, *args, key=None):
+        """请求在界面线程中调用func(*args)；指定key时同一个键在一个节拍内只执行最后一次（如预览图）"""
+        if key is None:
+            self._calls.append((func, args))
+        else:
+            self._latest_calls[key] = (func, args)
+
+    def close(self):
+        """工作结束：界面执行完剩余的更新和回调后停止轮询"""
+        self._closed = True
+
+    # 以下方法由界面线程调用
+    def snapshot(self):
+        """返回最新进度的快照；没有任何更新时返回None"""
+        progress, status = self._progress, self._status
+        if progress is None and status is None:
+            return None
+        if progress is None or (status is not None and status[1] > progress[4]):
+            # 最近一次是状态文字（如进入新阶段），进度字段沿用之前的值
+            stage, done, total, unit, _ = progress or ("", 0, 0, "个", 0)
+            return ProgressSnapshot(stage, done, total, unit, None, None, status[0])
+
+        stage, done, total, unit, now = progress
+        if stage != self._sample_stage:
+            self._samples.clear()
+            self._sample_stage = stage
+        if not self._samples or self._samples[-1][0] != now:
+            self._samples.append((now, done))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.rate_window:
+            self._samples.popleft()
+
+        rate = eta = None
+        first_time, first_done = self._samples[0]
+        if now > first_time and done > first_done:
+            rate = (done - first_done) / (now - first_time)
+            eta = max(0, total - done) / rate
+        snapshot = ProgressSnapshot(stage, done, total, unit, rate, eta, None)
+        return snapshot._replace(status=format_progress(snapshot))
+
+    def drain(self):
+        """在界面线程中执行积攒的回调：先执行按键合并的最新回调，再按顺序执行其余回调，结束回调总在最后"""
+        while self._latest_calls:
+            _, (func, args) = self._latest_calls.popitem()
+            func(*args)
+        while self._calls:
+            func, args = self._calls.popleft()
+            func(*args)
+
+    def attach(self, root, on_progress=None, interval_ms=100):
+        """用root.after按固定节拍轮询：先以最新快照调用on_progress(snapshot)，再执行积攒的回调
+
+        on_progress为None时只执行回调（如缩略图通道，不报告进度）
+        """
+        last = [None]
+
+        def tick():
+            self._job = None
+            closed = self._closed
+            snapshot = self.snapshot()
+            if on_progress is not None and snapshot is not None and snapshot != last[0]:
+                last[0] = snapshot
+                on_progress(snapshot)
+            self.drain()
+            if not closed:
+                self._job = root.after(interval_ms, tick)
+
+        self._job = root.after(interval_ms, tick)
+
+    def detach(self, root):
+        """立即停止轮询，不再执行剩余的回调"""
+        if self._job is not None:
+            root.after_cancel(self._job)
+            self._job = None
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_duplicate_finder as finder
+
+
+def save_16bit_png(path):
+    gradient = np.linspace(0, 65535, 600 * 600).reshape(600, 600).astype(np.uint16)
+    Image.fromarray(gradient).save(path)
+    with Image.open(path) as img:
+        assert img.mode.startswith("I;16")
+
+
+def test_fast_decode_handles_16bit_png(tmp_path):
+    path = str(tmp_path / "a.png")
+    save_16bit_png(path)
+    for method in ("phash", "ssim"):
+        fast = finder.extract_feature_chunk([path], method, fast_decode=True)
+        exact = finder.extract_feature_chunk([path], method, fast_decode=False)
+        assert fast[0][1] is None
+        assert fast == exact
+
+
+def brute_force_pairs(hashes, max_distance):
+    store = finder.PackedHashStore(hashes)
+    rows, cols, distances = [], [], []
+    for index in range(len(hashes)):
+        matches, match_distances = store.query(hashes[index], max_distance, start=index + 1)
+        rows.extend([index] * len(matches))
+        cols.extend(matches.tolist())
+        distances.extend(match_distances.tolist())
+    return rows, cols, distances
+
+
+def test_multi_index_hash_matches_brute_force():
+    rng = np.random.default_rng(0)
+    bases = rng.integers(0, 2 ** 63, 100, dtype=np.uint64)
+    hashes = np.repeat(bases, 5)
+    bits = rng.integers(0, 64, (len(hashes), 8)).astype(np.uint64)
+    for column in range(bits.shape[1]):
+        flip = rng.random(len(hashes)) < 0.5
+        hashes[flip] ^= np.uint64(1) << bits[flip, column]
+    hashes[::7] &= ~np.uint64(0xFFFF)  # 让一段取值大量重复
+    hashes = np.unique(hashes)
+    
+    index = finder.MultiIndexHashStore(hashes, block_elements=4096)
+    for max_distance in (0, 3, 6, 12, 20):
+        # 分区间查询，模拟从检查点继续比较
+        parts = [index.query_range(start, min(start + 37, len(hashes)), max_distance)
+                 for start in range(0, len(hashes), 37)]
+        rows, cols, distances = (np.concatenate(values) for values in zip(*parts))
+        order = np.lexsort((cols, rows))
+        expected = brute_force_pairs(hashes, max_distance)
+        assert rows[order].tolist() == expected[0]
+        assert cols[order].tolist() == expected[1]
+        assert distances[order].tolist() == expected[2]
@@ -0,0 +1,117 @@
+import io
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import photo_classifier as classifier
+
+
+def test_rate_limiter_admits_at_most_rate_per_second():
+    rate = 5
+    app = classifier.PhotoClassifierApp.__new__(classifier.PhotoClassifierApp)
+    app.requests_per_second = rate
+    limiter = app.create_rate_limiter()
+    admitted = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            limiter.acquire()
+            now = time.monotonic()
+            with lock:
+                if len(admitted) >= 3 * rate:
+                    return
+                admitted.append(now)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    admitted.sort()
+    for index, start in enumerate(admitted):
+        in_window = sum(1 for moment in admitted[index:] if moment < start + 1)
+        assert in_window <= rate
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def make_retry_app(responses, monkeypatch):
+    app = classifier.PhotoClassifierApp.__new__(classifier.PhotoClassifierApp)
+    app.api_url = "http://example.invalid"
+    app.connect_timeout = app.read_timeout = 1
+    app.max_retries = 5
+    app.backoff_base = 1.0
+    app.backoff_max = 60.0
+    app.retry_after_max = 300.0
+    app.rate_limiter = None
+    app.processing = True
+    app.session = FakeSession(responses)
+    sleeps = []
+    monkeypatch.setattr(classifier.time, "sleep", sleeps.append)
+    return app, sleeps
+
+
+def test_retry_waits_at_least_retry_after(monkeypatch):
+    app, sleeps = make_retry_app([FakeResponse(429, {"Retry-After": "120"}), FakeResponse(200)], monkeypatch)
+    response = app.post_with_retry({}, {})
+    assert response.status_code == 200
+    assert sleeps == [120.0]
+
+
+def test_retry_gives_up_when_retry_after_too_long(monkeypatch):
+    app, sleeps = make_retry_app([FakeResponse(429, {"Retry-After": "3600"}), FakeResponse(200)], monkeypatch)
+    response = app.post_with_retry({}, {})
+    assert response.status_code == 429
+    assert app.session.calls == 1
+    assert sleeps == []
+
+
+def decode_upload(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return img.convert("RGB")
+
+
+def test_encode_for_upload_scales_16bit_to_8bit(tmp_path):
+    path = str(tmp_path / "gray16.png")
+    gradient = np.tile(np.linspace(0, 65535, 256).astype(np.uint16), (64, 1))
+    Image.fromarray(gradient).save(path)
+
+    data, mime_type = classifier.encode_for_upload(path)
+    pixels = np.asarray(decode_upload(data), dtype=np.int32)[:, :, 0]
+    assert mime_type == "image/jpeg"
+    assert pixels[:, :16].mean() < 20
+    assert 100 < pixels[:, 120:136].mean() < 155
+    assert pixels[:, -16:].mean() > 235
+
+
+def test_encode_for_upload_converts_cmyk_jpeg(tmp_path):
+    path = str(tmp_path / "cmyk.jpg")
+    Image.new("CMYK", (32, 32), (0, 255, 255, 0)).save(path, quality=95)
+
+    data, mime_type = classifier.encode_for_upload(path)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.mode == "RGB"
+    red, green, blue = np.asarray(decode_upload(data), dtype=np.int32).reshape(-1, 3).mean(axis=0)
+    assert red > 200 and green < 60 and blue < 60